@@ -0,0 +1,245 @@
+import asyncio
+import io
+import logging
+import sys
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web, ClientError, ClientSession, ClientTimeout, TCPConnector
+from multidict import CIMultiDict
+
+import events
+
+WORKERS = 32  # Threads running request handlers
+BACKLOG = 2048  # Pending connections queued by the kernel
+PEER_CONNECTIONS = 4  # Open connections per peer
+MAX_REQUEST_BYTES = 64 * 1024 * 1024  # Largest request body accepted
+PEER_ERRORS = (ClientError, asyncio.TimeoutError)
+STREAM_AFTER = 2  # Response chunks after which the rest of the body is streamed
+HOP_BY_HOP = {"content-length", "transfer-encoding", "connection"}
+log = logging.getLogger("aserver")
+
+
+class AsyncServer:
+    def __init__(self, wsgi_app, workers=None, event_log=None):
+        """
+        Serves a WSGI app from an asyncio event loop. Connections are accepted
+        and read on the loop, so idle and slow clients cost no thread; only
+        requests being handled take one of `workers` threads. Outbound peer
+        requests made through the server's client run on the loop as well.
+        With an `event_log`, /subscribe is served on the loop too.
+        """
+        self.wsgi_app = wsgi_app
+        self.event_log = event_log
+        self.published = None  # asyncio.Event set and replaced on each published event
+        self.workers = workers or WORKERS
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="handler")
+        self.loop = None
+        self.session = None
+        self.running = set()  # background jobs running, as (coroutine function, args)
+        self.rerun = set()  # background jobs requested again while running
+
+    def environ(self, request, body):
+        """WSGI environ of an aiohttp request."""
+        path, _, query = request.raw_path.partition("?")
+        host, port = (request.transport.get_extra_info("sockname") or ("127.0.0.1", 0))[:2]
+        environ = {
+            "REQUEST_METHOD": request.method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": urllib.parse.unquote_to_bytes(path).decode("latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": str(host),
+            "SERVER_PORT": str(port),
+            "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+            "REMOTE_ADDR": request.remote or "",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": request.scheme,
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in request.headers.items():
+            key = name.upper().replace("-", "_")
+            if key == "CONTENT_TYPE":
+                environ[key] = value
+            elif key != "CONTENT_LENGTH":
+                key = f"HTTP_{key}"
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def start_app(self, environ):
+        """
+        Runs the WSGI app in a worker up to its first chunks; returns (status,
+        headers, first chunks, iterator over the rest or None).
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = status
+            response["headers"] = headers
+            return lambda data: None
+
+        result = self.wsgi_app(environ, start_response)
+        iterator = iter(result)
+        chunks = []
+        try:
+            for chunk in iterator:
+                chunks.append(chunk)
+                if len(chunks) == STREAM_AFTER:
+                    return response["status"], response["headers"], chunks, (result, iterator)
+        except BaseException:
+            self.close_app(result)
+            raise
+        self.close_app(result)
+        return response["status"], response["headers"], chunks, None
+
+    @staticmethod
+    def close_app(result):
+        if hasattr(result, "close"):
+            result.close()
+
+    async def handle(self, request):
+        body = await request.read()
+        status, headers, chunks, rest = await self.run_in_worker(self.start_app, self.environ(request, body))
+        code, _, reason = status.partition(" ")
+        length = next((value for name, value in headers if name.lower() == "content-length"), None)
+        headers = CIMultiDict((name, value) for name, value in headers if name.lower() not in HOP_BY_HOP)
+        if rest is None:
+            return web.Response(status=int(code), reason=reason or None, headers=headers, body=b"".join(chunks))
+        # Large bodies are sent as the app produces them, chunked unless their length is known
+        result, iterator = rest
+        response = web.StreamResponse(status=int(code), reason=reason or None, headers=headers)
+        try:
+            if length is not None:
+                response.content_length = int(length)
+            await response.prepare(request)
+            for chunk in chunks:
+                await response.write(chunk)
+            while (chunk := await self.run_in_worker(next, iterator, None)) is not None:
+                await response.write(chunk)
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client went away
+            pass
+        finally:
+            await self.run_in_worker(self.close_app, result)
+        return response
+
+    async def subscribe(self, request):
+        """/subscribe of the node, where waiting subscribers hold no worker thread."""
+        try:
+            last_seen, kinds, timeout = events.parse_query(request.query, self.event_log)
+            last_seen = int(request.headers.get("Last-Event-ID", last_seen))
+        except ValueError:
+            return web.json_response({"error": "Invalid query"}, status=400)
+        if events.wants_stream(request.headers.get("Accept")):
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            await response.prepare(request)
+            resume = last_seen
+            try:
+                while True:
+                    found, resume = self.event_log.since(resume, kinds)
+                    if found:
+                        await response.write(events.server_sent(found).encode())
+                    elif not await self.wait_for_event(resume, events.KEEPALIVE):
+                        await response.write(b": keepalive\n\n")
+            except ConnectionResetError:
+                # The subscriber went away
+                return response
+        found, resume = self.event_log.since(last_seen, kinds)
+        if not found and await self.wait_for_event(resume, timeout):
+            found, resume = self.event_log.since(resume, kinds)
+        return web.json_response(events.page(found, resume))
+
+    async def wait_for_event(self, last_seen, timeout):
+        """Waits until an event after `last_seen` is published; False on timeout."""
+        deadline = self.loop.time() + timeout
+        while self.event_log.last <= last_seen:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self.published.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def on_event(self):
+        # Called by the publishing thread
+        self.loop.call_soon_threadsafe(self.wake_subscribers)
+
+    def wake_subscribers(self):
+        self.published.set()
+        self.published = asyncio.Event()
+
+    async def run_in_worker(self, function, *args):
+        """Runs a blocking function in the worker pool."""
+        return await self.loop.run_in_executor(self.executor, function, *args)
+
+    def submit(self, function, *args):
+        """
+        Runs the coroutine function in the background on the loop; callable
+        from any thread. Requests for a job that is already running are
+        coalesced into a single run after the current one.
+        """
+        self.loop.call_soon_threadsafe(self._submit, (function, args))
+
+    def _submit(self, job):
+        if job in self.running:
+            self.rerun.add(job)
+            return
+        self.running.add(job)
+        self.loop.create_task(self._run(job))
+
+    async def _run(self, job):
+        function, args = job
+        try:
+            while True:
+                self.rerun.discard(job)
+                try:
+                    await function(*args)
+                except Exception:
+                    log.exception("Background job %s failed.", function.__name__)
+                if job not in self.rerun:
+                    break
+        finally:
+            self.running.discard(job)
+
+    async def post_json(self, url, data, timeout):
+        """POSTs JSON to a peer and returns the decoded JSON response."""
+        async with self.session.post(url, json=data, timeout=ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def get(self, url, params, headers, timeout):
+        """GETs from a peer; returns (content type, body bytes)."""
+        async with self.session.get(url, params=params, headers=headers, timeout=ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            return response.headers.get("Content-Type", ""), await response.read()
+
+    async def on_startup(self, app):
+        self.loop = asyncio.get_running_loop()
+        self.session = ClientSession(connector=TCPConnector(limit_per_host=PEER_CONNECTIONS))
+        if self.event_log is not None:
+            self.published = asyncio.Event()
+            self.event_log.listeners.append(self.on_event)
+
+    async def on_cleanup(self, app):
+        if self.event_log is not None:
+            self.event_log.listeners.remove(self.on_event)
+        await self.session.close()
+        self.executor.shutdown(wait=False)
+
+    def run(self, host, port):
+        app = web.Application(client_max_size=MAX_REQUEST_BYTES)
+        if self.event_log is not None:
+            app.router.add_get("/subscribe", self.subscribe)
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        log.info("Serving on %s:%s with %s workers.", host, port, self.workers)
+        access_log = logging.getLogger("aiohttp.access") if log.isEnabledFor(logging.DEBUG) else None
+        web.run_app(app, host=host, port=port, backlog=BACKLOG, access_log=access_log, print=None)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks of the node's hot paths on synthetic chains and wallets.
+Results are printed, or written with --output, as JSON so runs can be compared.
+"""
+import argparse
+import base64
+import json
+import platform
+import random
+import sys
+import time
+
+from Crypto.PublicKey import ECC
+
+import codec
+import node
+from merkle import merkle_root
+from miner import Miner, REWARD
+from proof_of_work import MiningEngine
+from transaction import Transaction, Input, parse_transaction, parse_input
+from utxo import Coin, UtxoSet
+from wallet import get_pub_address
+
+GENESIS_HASH = "ab589a2161962fc11a616b271098b4fee6653dbed584d7ced30c76efe4c7bd61"
+CHAIN_DIFFICULTY = 1  # Difficulty of the synthetic chains, low enough to generate them quickly
+
+
+def timed(function, repeat=3):
+    """Best wall time of `repeat` runs of `function`."""
+    best = None
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - time_start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def generate_wallets(count, rng):
+    """Addresses of `count` synthetic identities."""
+    return ["00" + "%048x" % rng.getrandbits(192) for _ in range(count)]
+
+
+def generate_keys(count):
+    """`count` P-256 key pairs with their addresses."""
+    keys = []
+    for _ in range(count):
+        key = ECC.generate(curve='p256')
+        keys.append((key, get_pub_address(key.public_key().export_key(format='raw'))))
+    return keys
+
+
+def random_id(rng):
+    return "%064x" % rng.getrandbits(256)
+
+
+def generate_chain(length, transactions_per_block, wallets, rng, difficulty=CHAIN_DIFFICULTY):
+    """
+    Valid chain at `difficulty`: each block pays a coinbase to a random wallet and
+    moves unspent coins between wallets. Transactions are not signed.
+    """
+    timestamp = 1_700_000_000.0
+    coinbase = Transaction("Coinbase", [Input(wallets[0], REWARD, "0" * 64).to_json()], None, timestamp)
+    chain = [{
+        "index": 0,
+        "timestamp": timestamp,
+        "transactions": [coinbase.to_json()],
+        "previous_hash": "0" * 64,
+        "nonce": 0,
+        "hash": difficulty * "0" + GENESIS_HASH[difficulty:],
+    }]
+    unspent = [Coin("0" * 64, wallets[0], REWARD)]
+    engine = MiningEngine(1)
+    for index in range(1, length):
+        timestamp += 1.0
+        outputs = [Input(rng.choice(wallets), REWARD, random_id(rng)).to_json()]
+        transactions = [Transaction("Coinbase", outputs, None, timestamp).to_json()]
+        created = [parse_input(outputs[0])]
+        for _ in range(min(transactions_per_block, len(unspent))):
+            coin = unspent.pop(rng.randrange(len(unspent)))
+            recipients = [Input(rng.choice(wallets), coin.amount, random_id(rng)).to_json()]
+            tx = Transaction(coin.address, recipients, None, timestamp, sender_input=[coin.to_json()])
+            transactions.append(tx.to_json())
+            created.append(parse_input(recipients[0]))
+        unspent.extend(Coin(out.id, out.address, out.amount) for out in created)
+        block = {
+            "index": index,
+            "timestamp": timestamp,
+            "transactions": transactions,
+            "merkle_root": merkle_root(transactions),
+            "previous_hash": chain[-1]["hash"],
+            "nonce": 0,
+        }
+        block["hash"] = engine.mine(block, difficulty)
+        chain.append(block)
+    return chain
+
+
+def bench_mining(difficulties, workers, blocks):
+    """Mines `blocks` empty blocks at each difficulty, as Miner.mine_block does."""
+    results = {}
+    for difficulty in difficulties:
+        engine = MiningEngine(workers)
+        for index in range(blocks):
+            block = {"index": index, "timestamp": 0.0, "merkle_root": "0" * 64, "previous_hash": "0" * 64, "nonce": 0}
+            engine.mine(block, difficulty)
+        results[str(difficulty)] = {
+            "workers": engine.workers,
+            "blocks": blocks,
+            "hashes": engine.hashes,
+            "seconds": engine.elapsed,
+            "hashes_per_second": engine.hashes / engine.elapsed,
+        }
+        engine.shutdown()
+    return results
+
+
+def bench_validate_chain(chain):
+    node.DIFFICULTY = CHAIN_DIFFICULTY
+
+    def cold():
+        node.block_chain.clear()
+        node.verified_height = -1
+        assert node.validate_chain(chain)
+
+    seconds = timed(cold)
+    node.block_chain[:] = chain[:-10]
+    node.verified_height = -1
+    node.validate_chain(node.block_chain)
+    incremental = timed(lambda: node.validate_chain(chain))
+    node.block_chain.clear()
+    node.verified_height = -1
+    return {
+        "blocks": len(chain),
+        "seconds": seconds,
+        "blocks_per_second": len(chain) / seconds,
+        "incremental_10_blocks_seconds": incremental,
+    }
+
+
+def bench_unspent_inputs(chain, wallets):
+    miner = Miner(chain[:1], {}, None, workers=1)
+
+    def replay(clear_cache):
+        if clear_cache:
+            parse_transaction.cache_clear()
+            parse_input.cache_clear()
+        miner.unspent_inputs = UtxoSet()
+        for block in chain:
+            miner.update_unspent_inputs(block)
+
+    cold = timed(lambda: replay(True))
+    warm = timed(lambda: replay(False))
+    transactions = sum(len(block["transactions"]) for block in chain)
+    lookups = [wallets[i % len(wallets)] for i in range(100_000)]
+    balances = timed(lambda: [miner.get_balance(address) for address in lookups])
+    miner.engine.shutdown()
+    return {
+        "blocks": len(chain),
+        "transactions": transactions,
+        "coins": len(miner.unspent_inputs),
+        "replay_seconds_cold": cold,
+        "replay_seconds_warm": warm,
+        "transactions_per_second_cold": transactions / cold,
+        "get_balance_per_second": len(lookups) / balances,
+    }
+
+
+def bench_large_utxo_set(coins, wallets, rng):
+    utxo_set = UtxoSet()
+    ids = [random_id(rng) for _ in range(coins)]
+    insert = timed(lambda: [utxo_set.add(Coin(coin_id, wallets[i % len(wallets)], 1.0)) for i, coin_id in enumerate(ids)], repeat=1)
+    balance = timed(lambda: [utxo_set.balance(wallets[i % len(wallets)]) for i in range(100_000)])
+    spend = timed(lambda: [utxo_set.spend(coin_id) for coin_id in ids], repeat=1)
+    return {
+        "coins": coins,
+        "addresses": len(wallets),
+        "insert_per_second": coins / insert,
+        "balance_per_second": 100_000 / balance,
+        "spend_per_second": coins / spend,
+    }
+
+
+def bench_transactions(chain, keys):
+    transactions = [tx for block in chain for tx in block["transactions"]]
+    parsed = [Transaction.from_json(tx) for tx in transactions]
+    to_json = timed(lambda: [tx.to_json() for tx in parsed])
+    from_json = timed(lambda: [Transaction.from_json(tx) for tx in transactions])
+    encoded = codec.encode_blocks(chain)
+    encode = timed(lambda: codec.encode_blocks(chain))
+    decode = timed(lambda: codec.decode_blocks(encoded))
+
+    key, address = keys[0]
+    unsigned = [Transaction(address, random_id(random.Random(i))[:50], 1.0, float(i)) for i in range(200)]
+    sign = timed(lambda: [tx.sign_transaction(key) for tx in unsigned], repeat=1)
+    public_key = key.public_key()
+    verify = timed(lambda: [tx.verify_signature(public_key) for tx in unsigned], repeat=1)
+    pem = base64.b64encode(public_key.export_key(format='PEM').encode()).decode()
+    import_key = timed(lambda: [ECC.import_key(base64.b64decode(pem)) for _ in range(200)], repeat=1)
+    return {
+        "transactions": len(transactions),
+        "to_json_per_second": len(transactions) / to_json,
+        "from_json_per_second": len(transactions) / from_json,
+        "json_bytes": len(json.dumps(chain)),
+        "binary_bytes": len(encoded),
+        "binary_encode_blocks_per_second": len(chain) / encode,
+        "binary_decode_blocks_per_second": len(chain) / decode,
+        "sign_per_second": len(unsigned) / sign,
+        "verify_per_second": len(unsigned) / verify,
+        "import_key_per_second": 200 / import_key,
+    }
+
+
+def bench_fork_search(chain, rng):
+    fork = len(chain) * 3 // 4
+    remote = chain[:fork] + [dict(block, hash=random_id(rng)) for block in chain[fork:]]
+    common = timed(lambda: node.find_common_index(chain, remote))
+    return {
+        "blocks": len(chain),
+        "fork_height": fork,
+        "find_common_index_seconds": common,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', '-o', help='Write the results to this file instead of printing them.', type=str)
+    parser.add_argument('--seed', help='Seed of the synthetic data.', type=int, default=1)
+    parser.add_argument('--chain-length', help='Blocks in the synthetic chain.', type=int, default=2000)
+    parser.add_argument('--transactions', help='Transactions per synthetic block.', type=int, default=10)
+    parser.add_argument('--wallets', help='Number of synthetic wallets.', type=int, default=1000)
+    parser.add_argument('--utxo-coins', help='Coins in the large UTXO set benchmark.', type=int, default=500_000)
+    parser.add_argument('--difficulties', help='Mining difficulties to measure.', type=int, nargs='+', default=[3, 4, 5])
+    parser.add_argument('--mining-blocks', help='Blocks mined at each difficulty.', type=int, default=5)
+    parser.add_argument('--mining-workers', help='Processes used for mining.', type=int, default=1)
+    parser.add_argument('--quick', help='Small data sizes, for a smoke run.', action='store_true')
+    args = parser.parse_args()
+    if args.quick:
+        args.chain_length, args.utxo_coins, args.difficulties, args.mining_blocks = 200, 20_000, [3, 4], 3
+
+    rng = random.Random(args.seed)
+    wallets = generate_wallets(args.wallets, rng)
+    keys = generate_keys(1)
+    time_start = time.perf_counter()
+    chain = generate_chain(args.chain_length, args.transactions, wallets, rng)
+    generation = time.perf_counter() - time_start
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "arguments": vars(args),
+            "chain_generation_seconds": generation,
+        },
+        "results": {
+            "mine_block": bench_mining(args.difficulties, args.mining_workers, args.mining_blocks),
+            "validate_chain": bench_validate_chain(chain),
+            "update_unspent_inputs": bench_unspent_inputs(chain, wallets),
+            "utxo_set": bench_large_utxo_set(args.utxo_coins, wallets, rng),
+            "transactions": bench_transactions(chain, keys),
+            "fork_search": bench_fork_search(chain, rng),
+        },
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import codec
+
+INDEX_ENTRY = struct.Struct("<QI32s")  # offset, length and hash of the block at that height
+CACHE_SIZE = 256  # Recently read blocks kept decoded in memory
+
+
+class BlockStore:
+    def __init__(self, directory):
+        """
+        On-disk chain: binary block bodies are appended to blocks.dat, and blocks.idx holds
+        one fixed-size entry per height, so opening the store does not read the chain.
+        Behaves like the list of blocks it replaces.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.data_file = open(os.path.join(directory, "blocks.dat"), "a+b")
+        self.index_file = open(os.path.join(directory, "blocks.idx"), "a+b")
+        self.data_map = None
+        self.index_map = None
+        self.cache = OrderedDict()
+
+        index_size = os.fstat(self.index_file.fileno()).st_size
+        self.length = index_size // INDEX_ENTRY.size
+        # Drop a partially written entry or body left by an interrupted append,
+        # and entries that reached the disk before their body after a power loss.
+        self._remap()
+        data_size = os.fstat(self.data_file.fileno()).st_size
+        while self.length and self._end_of(self.length) > data_size:
+            self.length -= 1
+        self.index_file.truncate(self.length * INDEX_ENTRY.size)
+        self._remap()
+        self.data_end = self._end_of(self.length)
+        self.data_file.truncate(self.data_end)
+        self._remap()
+
+    def _remap(self):
+        """Maps the files again after they grew or shrank."""
+        for old in (self.data_map, self.index_map):
+            if old is not None:
+                old.close()
+        self.data_map = self._map(self.data_file)
+        self.index_map = self._map(self.index_file)
+
+    @staticmethod
+    def _map(file):
+        file.flush()
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _entry(self, height):
+        end = (height + 1) * INDEX_ENTRY.size
+        if self.index_map is None or end > len(self.index_map):
+            self._remap()
+        return INDEX_ENTRY.unpack_from(self.index_map, height * INDEX_ENTRY.size)
+
+    def _end_of(self, length):
+        if length == 0:
+            return 0
+        offset, size, _ = self._entry(length - 1)
+        return offset + size
+
+    def _read(self, height):
+        block = self.cache.get(height)
+        if block is not None:
+            self.cache.move_to_end(height)
+            return block
+        offset, size, _ = self._entry(height)
+        if self.data_map is None or offset + size > len(self.data_map):
+            self._remap()
+        body = self.data_map[offset:offset + size]
+        # Bodies written before the binary format are JSON objects.
+        block = json.loads(body) if body[:1] == b"{" else codec.decode_block(body)
+        self.cache[height] = block
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return block
+
+    def __repr__(self):
+        return f"BlockStore({self.directory!r}, {self.length} blocks)"
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        with self.lock:
+            if isinstance(key, slice):
+                return [self._read(height) for height in range(*key.indices(self.length))]
+            if key < 0:
+                key += self.length
+            if not 0 <= key < self.length:
+                raise IndexError("block height out of range")
+            return self._read(key)
+
+    def __iter__(self):
+        for height in range(self.length):
+            yield self[height]
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if len(other) != self.length:
+            return False
+        return all(self.hash_at(height) == block["hash"] for height, block in enumerate(other))
+
+    def hash_at(self, height):
+        """Hash of the block at `height`, read from the index only."""
+        with self.lock:
+            return self._entry(height)[2].hex()
+
+    def append(self, block):
+        self.extend([block])
+
+    def extend(self, blocks):
+        blocks = list(blocks)
+        with self.lock:
+            entries = []
+            offset = self.data_end
+            for block in blocks:
+                body = codec.encode_block(block)
+                self.data_file.write(body)
+                entries.append(INDEX_ENTRY.pack(offset, len(body), bytes.fromhex(block["hash"])))
+                offset += len(body)
+            if not entries:
+                return
+            self.data_file.flush()
+            # The bodies must be on disk before an index entry can point at them.
+            os.fsync(self.data_file.fileno())
+            self.index_file.write(b"".join(entries))
+            self.index_file.flush()
+            for block in blocks:
+                self.cache[self.length] = block
+                self.length += 1
+            while len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+            self.data_end = offset
+
+    def truncate(self, length):
+        """Drops the blocks from `length` on."""
+        with self.lock:
+            if length >= self.length:
+                return
+            data_end = self._end_of(length)
+            for height in range(length, self.length):
+                self.cache.pop(height, None)
+            for old in (self.data_map, self.index_map):
+                if old is not None:
+                    old.close()
+            self.data_map = self.index_map = None
+            self.index_file.truncate(length * INDEX_ENTRY.size)
+            self.data_file.truncate(data_end)
+            self.data_end = data_end
+            self.length = length
+            self._remap()
+
+    def clear(self):
+        self.truncate(0)
+
+    def __delitem__(self, key):
+        if not isinstance(key, slice) or key.stop is not None or key.step is not None:
+            raise TypeError("only the tail of the chain can be removed")
+        self.truncate(key.indices(self.length)[0])
+
+    def __setitem__(self, key, blocks):
+        """Replaces the tail of the chain: store[start:] = blocks."""
+        with self.lock:
+            del self[key]
+            self.extend(blocks)
+
+    def close(self):
+        with self.lock:
+            for old in (self.data_map, self.index_map):
+                if old is not None:
+                    old.close()
+            self.data_file.close()
+            self.index_file.close()
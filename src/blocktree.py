@@ -0,0 +1,116 @@
+from miner import DIFFICULTY
+
+MAX_FORK_DEPTH = 100  # Side branches forking further below the tip are dropped
+
+
+def block_work(difficulty):
+    """Expected number of hashes needed for a block with `difficulty` leading hex zeros."""
+    return 16 ** difficulty
+
+
+class ChainView:
+    def __init__(self, base, start, blocks):
+        """
+        The first `start` blocks of `base` followed by `blocks`, without copying
+        `base`. Used for peer chains that share a prefix with the local one.
+        """
+        self.base = base
+        self.start = start
+        self.blocks = blocks
+
+    def __len__(self):
+        return self.start + len(self.blocks)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("chain index out of range")
+        if key < self.start:
+            return self.base[key]
+        return self.blocks[key - self.start]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class BlockTree:
+    def __init__(self, chain, difficulty=DIFFICULTY):
+        """
+        Known blocks: the active chain, kept by the caller, and the side branches
+        forking from it. Each block adds the same work, so the cumulative work of
+        a main chain block follows from its height; side blocks store theirs.
+        """
+        self.chain = chain
+        self.block_work = block_work(difficulty)
+        self.side = {}  # block hash -> (block, cumulative work)
+
+    def work_at(self, height):
+        """Cumulative work of the main chain up to `height`."""
+        return (height + 1) * self.block_work
+
+    def tip_work(self):
+        return self.work_at(len(self.chain) - 1)
+
+    def on_main_chain(self, block_hash, height):
+        return isinstance(height, int) and 0 <= height < len(self.chain) and self.chain[height]["hash"] == block_hash
+
+    def knows(self, block_hash, height):
+        return block_hash in self.side or self.on_main_chain(block_hash, height)
+
+    def get(self, block_hash, height):
+        """Known block with this hash, `height` being its claimed height; None if unknown."""
+        if block_hash in self.side:
+            return self.side[block_hash][0]
+        if self.on_main_chain(block_hash, height):
+            return self.chain[height]
+        return None
+
+    def work_of(self, block_hash, height):
+        """Cumulative work up to a known block, or None."""
+        if block_hash in self.side:
+            return self.side[block_hash][1]
+        if self.on_main_chain(block_hash, height):
+            return self.work_at(height)
+        return None
+
+    def add_side(self, block):
+        """
+        Stores a block off the main chain; returns its cumulative work, or None
+        without storing it if its parent is unknown.
+        """
+        parent_work = self.work_of(block["previous_hash"], block["index"] - 1)
+        if parent_work is None:
+            return None
+        work = parent_work + self.block_work
+        self.side[block["hash"]] = (block, work)
+        return work
+
+    def remove_side(self, block_hash):
+        self.side.pop(block_hash, None)
+
+    def branch(self, block_hash):
+        """
+        Side blocks from the main chain up to `block_hash`, oldest first, and the
+        height of the main chain block they fork from.
+        """
+        blocks = []
+        while block_hash in self.side:
+            block = self.side[block_hash][0]
+            blocks.append(block)
+            block_hash = block["previous_hash"]
+        blocks.reverse()
+        return blocks[0]["index"] - 1, blocks
+
+    def prune(self):
+        """
+        Drops side blocks too far below the tip to matter, then the blocks
+        left without a known parent, so every branch still reaches the main chain.
+        """
+        lowest = len(self.chain) - MAX_FORK_DEPTH
+        for block, _ in sorted(self.side.values(), key=lambda entry: entry[0]["index"]):
+            if block["index"] < lowest or not self.knows(block["previous_hash"], block["index"] - 1):
+                del self.side[block["hash"]]
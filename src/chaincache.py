@@ -0,0 +1,112 @@
+import json
+import threading
+import zlib
+
+import codec
+
+CHUNK_BLOCKS = 256  # Blocks serialized at a time while building a body
+STREAM_BYTES = 64 * 1024  # Size of the chunks a body is sent in
+GZIP_LEVEL = 6
+GZIP_WINDOW = 16 + zlib.MAX_WBITS  # zlib window bits selecting the gzip container
+BUILD_ATTEMPTS = 3  # Builds tried without the chain lock before holding it
+
+
+def etag(tip_hash, height, kind, gzipped):
+    """Entity tag of the chain up to a tip, in one encoding and content coding."""
+    return f"{tip_hash}-{height}-{kind}{'-gzip' if gzipped else ''}"
+
+
+def tip_of(chain):
+    """(hash, height) of the tip of a chain; (None, -1) while it is empty."""
+    if not chain:
+        return None, -1
+    tip = chain[-1]
+    return tip["hash"], tip["index"]
+
+
+def json_parts(count, chunks):
+    """JSON array of `count` blocks given as an iterable of lists of blocks."""
+    yield b"["
+    first = True
+    for blocks in chunks:
+        if not blocks:
+            continue
+        part = ",".join(json.dumps(block, separators=(",", ":")) for block in blocks)
+        yield (part if first else "," + part).encode()
+        first = False
+    yield b"]"
+
+
+ENCODERS = {"json": json_parts, "binary": codec.encode_blocks_parts}
+
+
+def stream(body):
+    """A cached body in STREAM_BYTES chunks."""
+    view = memoryview(body)
+    for start in range(0, len(body), STREAM_BYTES):
+        yield bytes(view[start:start + STREAM_BYTES])
+
+
+def stream_decompressed(body):
+    """A cached gzip body, decompressed one chunk at a time."""
+    decompressor = zlib.decompressobj(GZIP_WINDOW)
+    for chunk in stream(body):
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+class ChainCache:
+    def __init__(self, chain, chain_lock):
+        """
+        /get_blockchain bodies of the current tip, one per encoding of the
+        blocks, kept gzip-compressed. A body is built once per tip by feeding
+        the chain through the compressor a chunk of blocks at a time, so no
+        uncompressed copy of the chain is ever held; clients that do not
+        accept gzip get it decompressed on the fly.
+        """
+        self.chain = chain
+        self.chain_lock = chain_lock
+        self.entries = {}  # kind -> (tip hash, height, gzip body)
+        self.build_lock = threading.Lock()  # Concurrent misses wait for one build
+
+    def invalidate(self):
+        self.entries = {}
+
+    def get(self, kind):
+        """(tip hash, height, gzip body) of the chain in `kind` encoding, built if missing."""
+        entry = self.entries.get(kind)
+        if entry is not None and entry[0] == tip_of(self.chain)[0]:
+            return entry
+        with self.build_lock:
+            entry = self.entries.get(kind)
+            if entry is not None and entry[0] == tip_of(self.chain)[0]:
+                return entry
+            for _ in range(BUILD_ATTEMPTS):
+                entry = self.build(kind)
+                if entry is not None:
+                    break
+            else:
+                # The chain kept being reorganized under the build.
+                with self.chain_lock:
+                    entry = self.build(kind)
+            self.entries[kind] = entry
+            return entry
+
+    def build(self, kind):
+        """
+        Compresses the chain up to the current tip. Returns None if blocks
+        below the tip were replaced meanwhile, so the body may mix branches.
+        """
+        tip_hash, height = tip_of(self.chain)
+        count = height + 1
+        chunks = (self.chain[start:min(start + CHUNK_BLOCKS, count)] for start in range(0, count, CHUNK_BLOCKS))
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WINDOW)
+        parts = [compressor.compress(part) for part in ENCODERS[kind](count, chunks)]
+        parts.append(compressor.flush())
+        if count and (len(self.chain) < count or self.chain[count - 1]["hash"] != tip_hash):
+            return None
+        return tip_hash, height, b"".join(parts)
@@ -0,0 +1,301 @@
+import base64
+import binascii
+import json
+import struct
+
+CONTENT_TYPE = "application/x-cryptocurrency-binary"
+FORMAT_VERSION = 2  # 2 added the Merkle root to blocks
+
+U8 = struct.Struct("<B")
+U32 = struct.Struct("<I")
+I64 = struct.Struct("<q")
+F64 = struct.Struct("<d")
+
+# Tags of the variable fields
+HEX, TEXT, NONE = 0, 1, 2
+INT, FLOAT = 0, 1
+CANONICAL, RAW = 0, 1
+
+BLOCK_FIELDS = ("index", "timestamp", "nonce", "previous_hash", "hash", "merkle_root", "transactions")
+
+
+class Writer:
+    def __init__(self):
+        """
+        Builds a binary message.
+        """
+        self.buffer = bytearray()
+
+    def u8(self, value):
+        self.buffer += U8.pack(value)
+
+    def u32(self, value):
+        self.buffer += U32.pack(value)
+
+    def number(self, value):
+        if not is_number(value):
+            raise ValueError(f"not a number: {value!r}")
+        if isinstance(value, int):
+            self.u8(INT)
+            self.buffer += I64.pack(value)
+        else:
+            self.u8(FLOAT)
+            self.buffer += F64.pack(value)
+
+    def text(self, value):
+        data = value.encode()
+        self.u32(len(data))
+        self.buffer += data
+
+    def string(self, value):
+        """Lower-case hex strings, hashes and addresses, are stored as raw bytes."""
+        if value is None:
+            self.u8(NONE)
+        elif len(value) <= 510 and is_hex(value):
+            self.u8(HEX)
+            self.u8(len(value) // 2)
+            self.buffer += bytes.fromhex(value)
+        else:
+            self.u8(TEXT)
+            self.text(value)
+
+
+class Reader:
+    def __init__(self, data):
+        """
+        Reads a binary message.
+        """
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def take(self, size):
+        if self.pos + size > len(self.data):
+            raise ValueError("truncated message")
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+    def u8(self):
+        return U8.unpack(self.take(U8.size))[0]
+
+    def u32(self):
+        return U32.unpack(self.take(U32.size))[0]
+
+    def number(self):
+        if self.u8() == INT:
+            return I64.unpack(self.take(I64.size))[0]
+        return F64.unpack(self.take(F64.size))[0]
+
+    def text(self):
+        return bytes(self.take(self.u32())).decode()
+
+    def string(self):
+        tag = self.u8()
+        if tag == NONE:
+            return None
+        if tag == HEX:
+            return self.take(self.u8()).hex()
+        return self.text()
+
+
+def is_hex(value):
+    """Whether a string is lower-case hex that bytes.hex() gives back unchanged."""
+    try:
+        return bytes.fromhex(value).hex() == value
+    except ValueError:
+        return False
+
+
+def is_number(value):
+    """Whether Writer.number can store a value."""
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return -2 ** 63 <= value < 2 ** 63
+    return isinstance(value, float)
+
+
+def input_json(id, address, amount):
+    """Same serialization as Input.to_json."""
+    return json.dumps({"id": id, "address": address, "amount": amount})
+
+
+def transaction_json(transaction_id, timestamp, sender, sender_inputs, signature, recipients):
+    """Same serialization as Transaction.to_json."""
+    return json.dumps({
+        "transaction_id": transaction_id,
+        "timestamp": timestamp,
+        "sender": sender,
+        "sender_inputs": sender_inputs,
+        "signature": base64.b64encode(signature).decode() if signature else None,
+        "recipients": recipients,
+    })
+
+
+def write_input(writer, inp):
+    """Inputs that do not re-serialize to the same JSON are kept as text."""
+    try:
+        data = json.loads(inp)
+        fields = (data["id"], data["address"], data["amount"])
+        canonical = len(data) == 3 and input_json(*fields) == inp
+    except (ValueError, KeyError, TypeError):
+        canonical = False
+    if not canonical:
+        writer.u8(RAW)
+        writer.text(inp)
+        return
+    writer.u8(CANONICAL)
+    writer.string(fields[0])
+    writer.string(fields[1])
+    writer.number(fields[2])
+
+
+def read_input(reader):
+    if reader.u8() == RAW:
+        return reader.text()
+    return input_json(reader.string(), reader.string(), reader.number())
+
+
+def write_transaction(writer, transaction):
+    """Transactions that do not re-serialize to the same JSON are kept as text."""
+    try:
+        data = json.loads(transaction)
+        signature = base64.b64decode(data["signature"], validate=True) if data["signature"] else None
+        fields = (data["transaction_id"], data["timestamp"], data["sender"],
+                  data["sender_inputs"], signature, data["recipients"])
+        canonical = len(data) == 6 and transaction_json(*fields) == transaction
+        part = Writer()
+        if canonical:
+            part.string(fields[0])
+            part.number(fields[1])
+            part.string(fields[2])
+            part.u32(len(fields[3]))
+            for inp in fields[3]:
+                write_input(part, inp)
+            if signature is None:
+                part.u8(NONE)
+            else:
+                part.u8(HEX)
+                part.u8(len(signature))
+                part.buffer += signature
+            part.u32(len(fields[5]))
+            for out in fields[5]:
+                write_input(part, out)
+    except (ValueError, KeyError, TypeError, binascii.Error, struct.error):
+        canonical = False
+    if not canonical:
+        writer.u8(RAW)
+        writer.text(transaction)
+        return
+    writer.u8(CANONICAL)
+    writer.buffer += part.buffer
+
+
+def read_transaction(reader):
+    if reader.u8() == RAW:
+        return reader.text()
+    transaction_id = reader.string()
+    timestamp = reader.number()
+    sender = reader.string()
+    sender_inputs = [read_input(reader) for _ in range(reader.u32())]
+    signature = None
+    if reader.u8() == HEX:
+        signature = bytes(reader.take(reader.u8()))
+    recipients = [read_input(reader) for _ in range(reader.u32())]
+    return transaction_json(transaction_id, timestamp, sender, sender_inputs, signature, recipients)
+
+
+def write_block(writer, block):
+    """
+    Header fields of another type than the format stores are kept in the
+    extra JSON, which overrides the placeholder written in their place.
+    """
+    extra = {key: value for key, value in block.items() if key not in BLOCK_FIELDS}
+    for key in ("index", "timestamp", "nonce"):
+        if is_number(block[key]):
+            writer.number(block[key])
+        else:
+            writer.number(0)
+            extra[key] = block[key]
+    for key in ("previous_hash", "hash", "merkle_root"):
+        value = block[key] if key != "merkle_root" else block.get(key)
+        if value is None or isinstance(value, str):
+            writer.string(value)
+        else:
+            writer.string(None)
+            extra[key] = value
+    writer.u32(len(block["transactions"]))
+    for transaction in block["transactions"]:
+        write_transaction(writer, transaction)
+    writer.text(json.dumps(extra) if extra else "")
+
+
+def read_block(reader, version):
+    block = {
+        "index": reader.number(),
+        "timestamp": reader.number(),
+        "nonce": reader.number(),
+        "previous_hash": reader.string(),
+        "hash": reader.string(),
+    }
+    if version >= 2:
+        root = reader.string()
+        if root is not None:
+            block["merkle_root"] = root
+    block["transactions"] = [read_transaction(reader) for _ in range(reader.u32())]
+    extra = reader.text()
+    if extra:
+        block.update(json.loads(extra))
+    return block
+
+
+def encode_block(block):
+    """Binary form of a block."""
+    writer = Writer()
+    writer.u8(FORMAT_VERSION)
+    write_block(writer, block)
+    return bytes(writer.buffer)
+
+
+def decode_block(data):
+    """Block from its binary form."""
+    reader = Reader(data)
+    version = reader.u8()
+    if not 1 <= version <= FORMAT_VERSION:
+        raise ValueError("unsupported format version")
+    return read_block(reader, version)
+
+
+def encode_blocks(blocks):
+    """Binary form of a list of blocks."""
+    writer = Writer()
+    writer.u8(FORMAT_VERSION)
+    writer.u32(len(blocks))
+    for block in blocks:
+        write_block(writer, block)
+    return bytes(writer.buffer)
+
+
+def encode_blocks_parts(count, chunks):
+    """
+    encode_blocks of `count` blocks given as an iterable of lists of blocks,
+    yielded one part per list so the whole encoding is never held at once.
+    """
+    writer = Writer()
+    writer.u8(FORMAT_VERSION)
+    writer.u32(count)
+    yield bytes(writer.buffer)
+    for blocks in chunks:
+        writer = Writer()
+        for block in blocks:
+            write_block(writer, block)
+        yield bytes(writer.buffer)
+
+
+def decode_blocks(data):
+    """List of blocks from its binary form."""
+    reader = Reader(data)
+    version = reader.u8()
+    if not 1 <= version <= FORMAT_VERSION:
+        raise ValueError("unsupported format version")
+    return [read_block(reader, version) for _ in range(reader.u32())]
@@ -0,0 +1,87 @@
+import json
+import math
+import threading
+
+MAX_EVENTS = 10_000  # Events kept for subscribers catching up
+MAX_PAGE = 1000  # Events per long-poll response
+LONG_POLL_TIMEOUT = 30.0  # Longest wait of a long-poll request
+KEEPALIVE = 15.0  # Seconds between two comments on an idle stream
+KINDS = ("tip", "mempool")
+
+
+class EventLog:
+    def __init__(self, max_events=MAX_EVENTS):
+        """
+        Recent node events numbered from 1, for /subscribe. A subscriber asks
+        for the events after the last id it has seen. Threads wait on the
+        condition; an event loop registers a listener that wakes it up.
+        """
+        self.events = []  # (id, kind, data), oldest first
+        self.max_events = max_events
+        self.last = 0
+        self.condition = threading.Condition()
+        self.listeners = []  # Called without arguments after each event
+
+    def publish(self, kind, data):
+        with self.condition:
+            self.last += 1
+            self.events.append((self.last, kind, data))
+            if len(self.events) > 2 * self.max_events:
+                del self.events[:-self.max_events]
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def since(self, last_seen, kinds=KINDS, limit=MAX_PAGE):
+        """
+        Up to `limit` events of the given kinds after id `last_seen`, and the
+        id to resume from. Events older than the log are skipped; a `last_seen`
+        beyond the log, as after a restart, resumes from its end.
+        """
+        with self.condition:
+            first = self.events[0][0] if self.events else self.last + 1
+            resume = min(max(last_seen, first - 1), self.last)
+            events = []
+            for i in range(resume + 1 - first, len(self.events)):
+                if len(events) >= limit:
+                    break
+                event = self.events[i]
+                resume = event[0]
+                if event[1] in kinds:
+                    events.append(event)
+            return events, resume
+
+    def wait(self, last_seen, timeout):
+        """Blocks until an event after `last_seen` is published or the timeout expires."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.last > last_seen, timeout)
+
+
+def parse_query(args, log):
+    """
+    (last seen id, kinds, timeout) of a /subscribe query. Without `since` a
+    subscriber starts at the current end of the log. Raises ValueError for a
+    malformed `since` or `timeout`.
+    """
+    since = args.get("since")
+    last_seen = int(since) if since not in (None, "") else log.last
+    kinds = tuple(kind for kind in args.get("types", ",".join(KINDS)).split(",") if kind in KINDS)
+    timeout = float(args.get("timeout", LONG_POLL_TIMEOUT))
+    if not math.isfinite(timeout):
+        # NaN passes min and max unchanged and would wait forever
+        raise ValueError(f"invalid timeout: {timeout}")
+    return last_seen, kinds, min(max(timeout, 0.0), LONG_POLL_TIMEOUT)
+
+
+def page(events, resume):
+    """Long-poll response body."""
+    return {"events": [{"id": id, "type": kind, "data": data} for id, kind, data in events], "last": resume}
+
+
+def server_sent(events):
+    """Events in the text/event-stream format."""
+    return "".join(f"id: {id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n" for id, kind, data in events)
+
+
+def wants_stream(accept):
+    return "text/event-stream" in (accept or "")
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+"""
+Local load and propagation test: starts a network of nodes, funds generated
+identities from the miners' rewards, sends signed transactions at a target rate
+and reports throughput, latencies, forks and per-node resource usage as JSON.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from Crypto.PublicKey import ECC
+
+from transaction import Transaction, Input
+from wallet import get_pub_address
+
+NODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "node.py")
+TOPOLOGIES = ("star", "line", "tree", "random")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_LIMIT = 100  # Blocks per /blocks request, the node's MAX_BLOCKS
+MAX_ATTEMPTS = 3  # Times a coin is offered to the miners before it is given up
+
+
+def start_node(args, log, cwd):
+    """
+    Starts a node process with the given arguments, logging to `log`.
+    Returns the process object for later management.
+    """
+    return subprocess.Popen([sys.executable, NODE] + args, stdout=log, stderr=subprocess.STDOUT, cwd=cwd)
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def bootstrap_peer(i, topology, rng):
+    """Index of the node that node `i` joins."""
+    if topology == "star":
+        return 0
+    if topology == "line":
+        return i - 1
+    if topology == "tree":
+        return (i - 1) // 2
+    return rng.randrange(i)
+
+
+def random_id(rng):
+    return "%064x" % rng.getrandbits(256)
+
+
+class Identity:
+    def __init__(self, name=None):
+        """
+        Generated key pair with its address and serialized public key.
+        """
+        self.name = name
+        self.key = ECC.generate(curve='p256')
+        public_key = self.key.public_key()
+        self.address = get_pub_address(public_key.export_key(format='raw'))
+        self.pem = public_key.export_key(format='PEM')
+        self.pub_key = json.dumps({"key": base64.b64encode(self.pem.encode()).decode("utf-8")})
+
+    def sign(self, coins, recipients, rng):
+        """
+        Signed transaction spending `coins` (serialized inputs) to
+        [(Identity, amount), ...]. Returns the transaction and its outputs
+        as [(Identity, serialized output), ...].
+        """
+        outputs = [(identity, Input(identity.address, amount, random_id(rng)).to_json()) for identity, amount in recipients]
+        tx = Transaction(self.address, [output for _, output in outputs], None, time.time(), sender_input=coins)
+        tx.sign_transaction(self.key)
+        return tx, outputs
+
+
+def percentiles(values):
+    """Summary of a list of latencies in seconds."""
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def rank(p):
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": rank(0.50),
+        "p90": rank(0.90),
+        "p99": rank(0.99),
+        "max": values[-1],
+    }
+
+
+def process_tree(pid):
+    """The process and its descendants, from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as file:
+                    ppid = int(file.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def resource_usage(pid):
+    """(CPU seconds, RSS bytes) of a process and its descendants."""
+    cpu, rss = 0.0, 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/stat") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            with open(f"/proc/{member}/status") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) * 1024
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu, rss
+
+
+class Observer:
+    def __init__(self, urls, interval):
+        """
+        Polls the headers of every node and records when each block was first
+        seen on each node, fetching the body of every new block once.
+        """
+        self.urls = urls
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.views = [[] for _ in urls]  # Per node: [(index, hash), ...] of its chain
+        self.seen = {}  # block hash -> {node: first seen time}
+        self.blocks = {}  # block hash -> (index, [txid, ...])
+        self.confirmed = {}  # txid -> block hash it was first seen in
+        self.on_confirmed = None
+        self.stop = threading.Event()
+        self.threads = [threading.Thread(target=self.poll, args=(i,), daemon=True) for i in range(len(urls))]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def shutdown(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+    def locator(self, view):
+        locator = [{"index": index, "hash": block_hash} for index, block_hash in view[-10:][::-1]]
+        if view:
+            locator.append({"index": view[0][0], "hash": view[0][1]})
+        return locator
+
+    def poll(self, node):
+        session = requests.Session()
+        while not self.stop.is_set():
+            try:
+                self.poll_once(node, session)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"Polling {self.urls[node]} failed: {e}")
+            self.stop.wait(self.interval)
+
+    def poll_once(self, node, session):
+        url = self.urls[node]
+        view = self.views[node]
+        while True:
+            r = session.post(f"{url}/headers", json={"locator": self.locator(view)}, timeout=5)
+            r.raise_for_status()
+            data = r.json()
+            now = time.time()
+            headers = data["headers"]
+            del view[data["start"]:]
+            view.extend((header["index"], header["hash"]) for header in headers)
+            missing = [header for header in headers if header["hash"] not in self.blocks]
+            with self.lock:
+                for header in headers:
+                    self.seen.setdefault(header["hash"], {}).setdefault(node, now)
+            if missing:
+                self.fetch_bodies(session, url, missing)
+            if not headers or len(headers) < 2000:
+                return
+
+    def fetch_bodies(self, session, url, headers):
+        start = headers[0]["index"]
+        wanted = {header["hash"] for header in headers}
+        while start <= headers[-1]["index"]:
+            r = session.get(f"{url}/blocks", params={"from": start, "limit": PAGE_LIMIT}, timeout=10)
+            r.raise_for_status()
+            blocks = r.json()
+            if not blocks:
+                return
+            for block in blocks:
+                if block["hash"] not in wanted:
+                    continue
+                txids = [json.loads(transaction)["transaction_id"] for transaction in block["transactions"]]
+                with self.lock:
+                    if block["hash"] in self.blocks:
+                        continue
+                    self.blocks[block["hash"]] = (block["index"], txids)
+                    new = [txid for txid in txids if txid not in self.confirmed]
+                    for txid in new:
+                        self.confirmed[txid] = block["hash"]
+                if self.on_confirmed is not None:
+                    self.on_confirmed(new)
+            start += len(blocks)
+
+    def first_seen(self, block_hash):
+        return min(self.seen[block_hash].values())
+
+
+class LoadTest:
+    def __init__(self, args):
+        """
+        Network of local nodes and the wallets driving transactions through it.
+        """
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.workdir = args.workdir or tempfile.mkdtemp(prefix="loadtest-")
+        self.processes = []
+        self.logs = []
+        self.urls = [f"http://127.0.0.1:{args.base_port + i}" for i in range(args.nodes)]
+        self.miner_nodes = sorted({i * args.nodes // args.miners for i in range(args.miners)})
+        self.miners = {i: Identity(f"loadtest_miner{i}") for i in self.miner_nodes}
+        self.identities = [Identity() for _ in range(args.identities)]
+        self.lock = threading.Lock()
+        self.spendable = []  # [(identity, coin json), ...] confirmed and not yet spent
+        self.pending = {}  # txid -> [(identity, coin json), ...] outputs of an unconfirmed transaction
+        self.submitted = {}  # txid -> submit time of the accepted load transactions
+        self.attempts = {}  # coin json -> rejected attempts to spend it
+        self.sent = 0
+        self.rejected = 0
+        self.starved = 0
+        self.submit_executor = ThreadPoolExecutor(max_workers=len(self.miner_nodes))
+        self.observer = Observer(self.urls, args.poll_interval)
+        self.observer.on_confirmed = self.confirmed
+        self.usage = {i: [] for i in range(args.nodes)}  # node -> [(time, cpu seconds, rss bytes), ...]
+
+    def start_network(self):
+        keys = os.path.join(self.workdir, "keys")
+        os.makedirs(keys, exist_ok=True)
+        for identity in self.miners.values():
+            with open(os.path.join(keys, f"{identity.name}_pub.pem"), "wt") as file:
+                file.write(identity.pem)
+        topology_rng = random.Random(self.args.seed)
+        for i, url in enumerate(self.urls):
+            args = ["--port", str(self.args.base_port + i), "--difficulty", str(self.args.difficulty),
+                    "--mining-workers", "1", "--verify-workers", "1", "--server", self.args.server]
+            if i == 0:
+                args.append("--init")
+            else:
+                args += ["--join", str(self.args.base_port + bootstrap_peer(i, self.args.topology, topology_rng))]
+            if i in self.miners:
+                args += ["--miner", self.miners[i].name]
+            log = open(os.path.join(self.workdir, f"node{i}.log"), "wb")
+            self.logs.append(log)
+            print(f"Starting node {i}: {' '.join(args)}")
+            self.processes.append(start_node(args, log, self.workdir))
+            if not wait_until_ready(url):
+                raise RuntimeError(f"Node {i} did not start, see {log.name}")
+
+    def stop_network(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log in self.logs:
+            log.close()
+        self.submit_executor.shutdown()
+        if self.args.workdir or self.args.keep_logs:
+            print(f"Node logs kept in {self.workdir}")
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def sample_usage(self, stop):
+        while not stop.is_set():
+            now = time.time()
+            for i, process in enumerate(self.processes):
+                cpu, rss = resource_usage(process.pid)
+                self.usage[i].append((now, cpu, rss))
+            stop.wait(1.0)
+
+    def confirmed(self, txids):
+        """Outputs of confirmed transactions become spendable."""
+        with self.lock:
+            for txid in txids:
+                self.spendable.extend(self.pending.pop(txid, []))
+
+    def submit(self, transactions, load=False):
+        """
+        Sends [(Transaction, sender, spent coin, outputs), ...] to every miner.
+        A transaction counts as accepted if any miner pooled it. Returns one
+        boolean per transaction.
+        """
+        pairs = [(tx.to_json(), sender.pub_key) for tx, sender, _, _ in transactions]
+
+        def post(node):
+            try:
+                r = requests.post(f"{self.urls[node]}/add_transactions", json=pairs, timeout=10)
+                return r.json()["added"] if r.status_code == 201 else [False] * len(pairs)
+            except (requests.exceptions.RequestException, ValueError, KeyError):
+                return [False] * len(pairs)
+
+        send_time = time.time()
+        results = list(self.submit_executor.map(post, self.miner_nodes))
+        accepted = [any(result[j] for result in results) for j in range(len(pairs))]
+        with self.lock:
+            for ok, (tx, sender, coin, outputs) in zip(accepted, transactions):
+                if not ok:
+                    if load:
+                        self.rejected += 1
+                        # Usually the miners have not connected the block with the coin yet
+                        self.attempts[coin] = self.attempts.get(coin, 0) + 1
+                        if self.attempts[coin] < MAX_ATTEMPTS:
+                            self.spendable.append((sender, coin))
+                    continue
+                if tx.transaction_id in self.observer.confirmed:
+                    self.spendable.extend(outputs)
+                else:
+                    self.pending[tx.transaction_id] = outputs
+                if load:
+                    self.submitted[tx.transaction_id] = send_time
+        return accepted
+
+    def fund(self):
+        """Split the miners' rewards into coins of the generated identities."""
+        print(f"Funding {len(self.identities)} identities with {self.args.funding_coins} coins.")
+        used = set()
+        deadline = time.time() + self.args.funding_timeout
+        while time.time() < deadline:
+            with self.lock:
+                funded = len(self.spendable)
+                outstanding = self.args.funding_coins - funded - sum(len(outputs) for outputs in self.pending.values())
+            if funded >= self.args.funding_coins:
+                print(f"{funded} coins available.")
+                return True
+            if outstanding > 0:
+                unspent = requests.get(f"{self.urls[0]}/get_unspent_inputs", timeout=10).json()
+                batch = []
+                for miner in self.miners.values():
+                    for coin in unspent.get(miner.address, []):
+                        if coin in used or outstanding <= 0:
+                            continue
+                        used.add(coin)
+                        amount = json.loads(coin)["amount"] / self.args.outputs_per_coin
+                        recipients = [(self.rng.choice(self.identities), amount) for _ in range(self.args.outputs_per_coin)]
+                        tx, outputs = miner.sign([coin], recipients, self.rng)
+                        batch.append((tx, miner, coin, outputs))
+                        outstanding -= self.args.outputs_per_coin
+                if batch:
+                    for ok, (_, _, coin, _) in zip(self.submit(batch), batch):
+                        if not ok:
+                            used.discard(coin)
+            time.sleep(1.0)
+        print("Funding timed out.")
+        return False
+
+    def run_load(self):
+        """Sends `transactions` transactions at `rate` per second."""
+        print(f"Sending {self.args.transactions} transactions at {self.args.rate}/s.")
+        time_start = time.time()
+        while self.sent < self.args.transactions:
+            due = min(self.args.transactions, int((time.time() - time_start) * self.args.rate) + 1) - self.sent
+            batch = []
+            for _ in range(due):
+                with self.lock:
+                    if not self.spendable:
+                        break
+                    sender, coin = self.spendable.pop(self.rng.randrange(len(self.spendable)))
+                recipient = self.rng.choice(self.identities)
+                tx, outputs = sender.sign([coin], [(recipient, json.loads(coin)["amount"])], self.rng)
+                batch.append((tx, sender, coin, outputs))
+            self.starved += due - len(batch)
+            self.sent += due
+            if batch:
+                self.submit(batch, load=True)
+            time.sleep(max(0.0, time_start + (self.sent + 1) / self.args.rate - time.time()))
+        return time_start, time.time()
+
+    def drain(self):
+        """Waits for the submitted transactions to confirm."""
+        deadline = time.time() + self.args.drain_timeout
+        while time.time() < deadline:
+            with self.lock:
+                waiting = [txid for txid in self.submitted if txid not in self.observer.confirmed]
+            if not waiting:
+                return
+            time.sleep(0.5)
+        print(f"{len(waiting)} transactions still unconfirmed.")
+
+    def wait_for_convergence(self, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            tips = {tuple(view[-1]) if view else None for view in self.observer.views}
+            if len(tips) == 1:
+                return True
+            time.sleep(0.5)
+        return False
+
+    def report(self, load_start, load_end, drained_at, converged):
+        observer = self.observer
+        main_chain = list(observer.views[0])
+        main_hashes = {block_hash for _, block_hash in main_chain}
+        with observer.lock:
+            seen = {block_hash: dict(nodes) for block_hash, nodes in observer.seen.items()}
+            blocks = dict(observer.blocks)
+
+        # Blocks that appeared during the run; the chain before it was observed at once
+        run_blocks = {block_hash for block_hash, nodes in seen.items() if min(nodes.values()) >= load_start}
+        propagation = []
+        for block_hash in run_blocks:
+            times = sorted(seen[block_hash].values())
+            propagation.extend(t - times[0] for t in times[1:])
+        stale = run_blocks - main_hashes
+
+        included = {}
+        for block_hash in main_hashes:
+            if block_hash in blocks:
+                for txid in blocks[block_hash][1]:
+                    included[txid] = min(seen[block_hash].values())
+        submitted = dict(self.submitted)
+        latencies = [included[txid] - t for txid, t in submitted.items() if txid in included]
+        confirmed_in_load = sum(1 for txid in submitted if txid in included and included[txid] <= load_end)
+        load_seconds = load_end - load_start
+        total_seconds = max(drained_at - load_start, load_seconds)
+
+        nodes = []
+        for i, samples in self.usage.items():
+            if len(samples) < 2:
+                continue
+            (t0, cpu0, _), (t1, cpu1, rss1) = samples[0], samples[-1]
+            nodes.append({
+                "node": i,
+                "url": self.urls[i],
+                "miner": i in self.miners,
+                "cpu_percent": 100 * (cpu1 - cpu0) / (t1 - t0),
+                "cpu_seconds": cpu1 - cpu0,
+                "rss_bytes": rss1,
+                "peak_rss_bytes": max(rss for _, _, rss in samples),
+                "height": len(observer.views[i]) - 1,
+            })
+
+        return {
+            "meta": {
+                "python": sys.version.split()[0],
+                "timestamp": time.time(),
+                "arguments": vars(self.args),
+                "miner_nodes": sorted(self.miners),
+                "converged": converged,
+            },
+            "results": {
+                "transactions": {
+                    "offered_rate": self.args.rate,
+                    "offered": self.sent,
+                    "accepted": len(submitted),
+                    "rejected": self.rejected,
+                    "starved": self.starved,
+                    "confirmed": len(latencies),
+                    "load_seconds": load_seconds,
+                    "sustained_tps": confirmed_in_load / load_seconds if load_seconds > 0 else 0.0,
+                    "overall_tps": len(latencies) / total_seconds if total_seconds > 0 else 0.0,
+                },
+                "mempool_to_block_seconds": percentiles(latencies),
+                "block_propagation_seconds": percentiles(propagation),
+                "blocks": {
+                    "seen": len(run_blocks),
+                    "main_chain": len(run_blocks & main_hashes),
+                    "stale": len(stale),
+                    "stale_rate": len(stale) / len(run_blocks) if run_blocks else 0.0,
+                    "height": len(main_chain) - 1,
+                },
+                "nodes": nodes,
+            },
+        }
+
+    def run(self):
+        stop_sampling = threading.Event()
+        sampler = threading.Thread(target=self.sample_usage, args=(stop_sampling,), daemon=True)
+        try:
+            self.start_network()
+            sampler.start()
+            self.observer.start()
+            if not self.fund():
+                raise RuntimeError("Could not fund the identities")
+            load_start, load_end = self.run_load()
+            self.drain()
+            drained_at = time.time()
+            converged = self.wait_for_convergence()
+            return self.report(load_start, load_end, drained_at, converged)
+        finally:
+            stop_sampling.set()
+            self.observer.shutdown()
+            self.stop_network()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nodes', help='Number of nodes.', type=int, default=4)
+    parser.add_argument('--miners', help='Number of mining nodes, spread over the network. Node 0 always mines.', type=int, default=2)
+    parser.add_argument('--topology', help='Which node each new node joins.', choices=TOPOLOGIES, default="star")
+    parser.add_argument('--difficulty', help='Difficulty of the test network.', type=int, default=4)
+    parser.add_argument('--server', help='Server mode of the nodes.', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--identities', help='Number of generated identities.', type=int, default=200)
+    parser.add_argument('--transactions', help='Number of transactions to send.', type=int, default=2000)
+    parser.add_argument('--rate', help='Target transactions per second.', type=float, default=50.0)
+    parser.add_argument('--funding-coins', help='Coins handed to the identities before the load starts.', type=int, default=500)
+    parser.add_argument('--outputs-per-coin', help='Identity coins created from each mining reward.', type=int, default=50)
+    parser.add_argument('--funding-timeout', help='Seconds allowed for funding.', type=float, default=300.0)
+    parser.add_argument('--drain-timeout', help='Seconds to wait for the last transactions to confirm.', type=float, default=120.0)
+    parser.add_argument('--poll-interval', help='Seconds between two polls of a node.', type=float, default=0.1)
+    parser.add_argument('--base-port', help='Port of the first node.', type=int, default=4001)
+    parser.add_argument('--seed', help='Seed of the topology and transaction choices.', type=int, default=1)
+    parser.add_argument('--workdir', help='Directory for keys and node logs, kept after the run.', type=str)
+    parser.add_argument('--keep-logs', help='Keep the temporary directory with the node logs.', action='store_true')
+    parser.add_argument('--output', '-o', help='Write the results to this file instead of printing them.', type=str)
+    args = parser.parse_args()
+    args.miners = max(1, min(args.miners, args.nodes))
+
+    test = LoadTest(args)
+    report = test.run()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
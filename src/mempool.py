@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+from transaction import parse_transaction, parse_input
+
+MAX_COUNT = 50_000  # Transactions held at most
+MAX_BYTES = 64 * 1024 * 1024  # Serialized size held at most
+
+
+class MempoolEntry:
+    __slots__ = ("transaction", "inputs", "size")
+
+    def __init__(self, transaction, inputs):
+        """
+        Pool entry: the serialized transaction and the output ids it spends.
+        """
+        self.transaction = transaction
+        self.inputs = inputs
+        self.size = len(transaction)
+
+
+class Mempool:
+    def __init__(self, max_count=MAX_COUNT, max_bytes=MAX_BYTES):
+        """
+        Pending transactions indexed by transaction id and by the outputs they spend.
+        Entries are kept in arrival order; when a limit is exceeded the oldest
+        transactions are evicted first. Request threads and the mining thread
+        share the pool, so every change and every full read holds the lock.
+        """
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # transaction id -> MempoolEntry
+        self.spends = {}  # output id -> id of the pooled transaction spending it
+        self.size = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self.entries
+
+    def __iter__(self):
+        with self.lock:
+            return iter([entry.transaction for entry in self.entries.values()])
+
+    def get(self, transaction_id):
+        """Pooled serialized transaction, or None."""
+        entry = self.entries.get(transaction_id)
+        return entry.transaction if entry is not None else None
+
+    def add(self, transaction):
+        """
+        Add a serialized transaction. Returns False for coinbase transactions,
+        duplicates and transactions spending an output another pooled one spends.
+        """
+        tx = parse_transaction(transaction)
+        if tx.sender == "Coinbase" or tx.transaction_id in self.entries:
+            return False
+        inputs = tuple(parse_input(inp).id for inp in tx.sender_input)
+        with self.lock:
+            if tx.transaction_id in self.entries or any(input_id in self.spends for input_id in inputs):
+                return False
+            self.entries[tx.transaction_id] = MempoolEntry(transaction, inputs)
+            for input_id in inputs:
+                self.spends[input_id] = tx.transaction_id
+            self.size += len(transaction)
+            while len(self.entries) > self.max_count or self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+            return tx.transaction_id in self.entries
+
+    def remove(self, transaction_id):
+        """Drop a transaction; returns its entry or None."""
+        with self.lock:
+            entry = self.entries.pop(transaction_id, None)
+            if entry is None:
+                return None
+            for input_id in entry.inputs:
+                del self.spends[input_id]
+            self.size -= entry.size
+            return entry
+
+    def remove_block(self, block):
+        """Drop transactions confirmed by a block and those conflicting with it."""
+        with self.lock:
+            for transaction in block["transactions"]:
+                tx = parse_transaction(transaction)
+                self.remove(tx.transaction_id)
+                if tx.sender == "Coinbase":
+                    continue
+                for inp in tx.sender_input:
+                    conflicting = self.spends.get(parse_input(inp).id)
+                    if conflicting is not None:
+                        self.remove(conflicting)
+
+    def select(self, limit=None):
+        """Oldest pooled transactions for a block template."""
+        with self.lock:
+            entries = list(self.entries.values())
+        selected = []
+        for entry in entries:
+            if limit is not None and len(selected) >= limit:
+                break
+            selected.append(entry.transaction)
+        return selected
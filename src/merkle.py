@@ -0,0 +1,49 @@
+import hashlib
+
+
+def transaction_hash(transaction):
+    """Leaf hash of a serialized transaction as it is stored in the block."""
+    return hashlib.sha256(transaction.encode()).digest()
+
+
+def next_level(level):
+    """Hashes pairs of nodes; an odd last node is carried up unchanged."""
+    parents = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        parents.append(level[-1])
+    return parents
+
+
+def merkle_root(transactions):
+    """Merkle root over the serialized transactions of a block, as hex."""
+    level = [transaction_hash(transaction) for transaction in transactions]
+    if not level:
+        return "0" * 64
+    while len(level) > 1:
+        level = next_level(level)
+    return level[0].hex()
+
+
+def merkle_proof(transactions, position):
+    """
+    Sibling hashes from the leaf at `position` up to the root.
+    Each step is {"hash": hex, "side": "left" or "right"}, the side the sibling is on.
+    """
+    level = [transaction_hash(transaction) for transaction in transactions]
+    proof = []
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append({"hash": level[sibling].hex(), "side": "left" if sibling < position else "right"})
+        level = next_level(level)
+        position //= 2
+    return proof
+
+
+def verify_proof(transaction, proof, root):
+    """Checks that a serialized transaction is committed to by `root`."""
+    node = transaction_hash(transaction)
+    for step in proof:
+        sibling = bytes.fromhex(step["hash"])
+        node = hashlib.sha256(sibling + node if step["side"] == "left" else node + sibling).digest()
+    return node.hex() == root
@@ -0,0 +1,182 @@
+import bisect
+import threading
+import time
+from contextlib import ContextDecorator
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        """
+        Named metric with one value per combination of label values.
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # tuple of label values -> value
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """[(suffix, label values, extra labels, value), ...] for the exposition."""
+        with self.lock:
+            return [("", key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labels, key, extra)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None):
+        """
+        Metric that can go up and down. A gauge without labels can read its
+        value from `function` at collection time instead.
+        """
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            return [("", (), (), self.function())]
+        return super().samples()
+
+
+class Timer(ContextDecorator):
+    def __init__(self, histogram, labels):
+        """
+        Observes the seconds spent in a `with` block or a decorated function.
+        """
+        self.histogram = histogram
+        self.labels = labels
+        self.time_start = None
+
+    def _recreate_cm(self):
+        # A fresh timer per call, so a decorated function can run in several threads
+        return Timer(self.histogram, self.labels)
+
+    def __enter__(self):
+        self.time_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.time_start, **self.labels)
+        return False
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Distribution of observed values over cumulative buckets.
+        """
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per bucket counts, then the sum and the count of all observations
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Context manager and decorator observing the elapsed seconds."""
+        return Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    samples.append(("_bucket", key, (("le", format_value(bound)),), cumulative))
+                samples.append(("_sum", key, (), total))
+                samples.append(("_count", key, (), count))
+        return samples
+
+
+def render():
+    """All registered metrics in the Prometheus text format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Mining
+HASHES = Counter("mining_hashes_total", "Hashes computed by the proof-of-work engine.")
+HASH_RATE = Gauge("mining_hash_rate", "Hashes per second of the last mining job.")
+BLOCKS_MINED = Counter("blocks_mined_total", "Blocks mined by this node.")
+
+# Chain
+BLOCKS_ACCEPTED = Counter("blocks_accepted_total", "Blocks connected to the chain.")
+BLOCKS_ORPHANED = Counter("blocks_orphaned_total", "Blocks stored as orphans.", ["reason"])
+CHAIN_HEIGHT = Gauge("chain_height", "Height of the chain tip.")
+VALIDATE_CHAIN_SECONDS = Histogram("validate_chain_seconds", "Duration of validate_chain.")
+VALIDATE_BLOCK_SECONDS = Histogram("validate_block_seconds", "Duration of validate_block.")
+
+# State
+MEMPOOL_TRANSACTIONS = Gauge("mempool_transactions", "Transactions in the pool.")
+MEMPOOL_BYTES = Gauge("mempool_bytes", "Serialized size of the transactions in the pool.")
+UTXO_COINS = Gauge("utxo_coins", "Unspent outputs in the UTXO set.")
+
+# Network
+BROADCAST_SECONDS = Histogram("broadcast_seconds", "Latency of messages sent to peers.", ["peer", "endpoint"])
+BROADCAST_FAILURES = Counter("broadcast_failures_total", "Messages that could not be delivered to a peer.", ["peer", "endpoint"])
+REQUEST_SECONDS = Histogram("http_request_seconds", "Latency of the HTTP endpoints.", ["route", "method", "status"])
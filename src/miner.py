@@ -1,99 +1,172 @@
-import hashlib
 import json
+import logging
 import random
-import requests
+import threading
 import time
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import ECC
-import base64
 from utils import broadcast_message
+from proof_of_work import MiningEngine
+from merkle import merkle_root
+from metrics import BLOCKS_MINED
+import profiler
+import codec
 
-from transaction import Transaction, Input
+from transaction import Transaction, Input, parse_transaction, parse_input
+from utxo import Coin, UtxoSet, save_snapshot, load_snapshot, valid_amount
+from mempool import Mempool
+from signatures import SignatureVerifier
 from wallet import get_pub_address, KEYS
 
 REWARD = 50.0
 DIFFICULTY = 5  # Number of leading zeros required in the hash
+SNAPSHOT_INTERVAL = 100  # Blocks between two UTXO snapshots
+UNDO_DEPTH = 1000  # Blocks below the tip whose undo records are kept
+log = logging.getLogger("miner")
+
+
+def valid_amounts(tx):
+    """Whether every output of a parsed transaction has a finite numeric amount."""
+    return all(valid_amount(parse_input(out).amount) for out in tx.recipients)
+
 
 class Miner:
-    def __init__(self, blockchain, nodes, owner):
-        self.transaction_pool = []
+    def __init__(self, blockchain, nodes, owner, workers=None, snapshot_path=None, mempool=None, verifier=None, difficulty=DIFFICULTY, on_block_mined=None):
+        self.difficulty = difficulty
+        self.on_block_mined = on_block_mined  # Hands mined blocks to the node instead of broadcasting them
+        self.transaction_pool = mempool if mempool is not None else Mempool()
         self.blockchain = blockchain
-        self.unspent_inputs = {}    
-        self.mining_executor = ThreadPoolExecutor(max_workers=1)
+        self.verifier = verifier if verifier is not None else SignatureVerifier()
+        self.unspent_inputs = UtxoSet()
+        self.undo = OrderedDict()  # block hash -> coins the block spent
+        self.mining_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mining")
+        self.engine = MiningEngine(workers)
+        self.mining_lock = threading.Lock()
+        self.mining_job = None  # (tip hash, stop event) of the current mining job
         self.nodes = nodes
         self.mining = False
         self.address = None
+        self.snapshot_path = snapshot_path
         if owner: self.change_owner(owner)
 
         if not self.blockchain:
             # print("generating genesis here")
             genesis_block = self.create_genesis_block()
             self.blockchain.append(genesis_block)
-        for block in self.blockchain:
-            print(block)
-            self.update_unspent_inputs(block)
+        self.load_unspent_inputs()
+
+    def load_unspent_inputs(self):
+        """Start from the UTXO snapshot if it matches the chain and replay the blocks after it."""
+        start = 0
+        snapshot = load_snapshot(self.snapshot_path) if self.snapshot_path else None
+        if snapshot is not None:
+            utxo_set, height, tip_hash = snapshot
+            if height < len(self.blockchain) and self.blockchain[height]["hash"] == tip_hash:
+                self.unspent_inputs = utxo_set
+                start = height + 1
+                log.info("UTXO snapshot at height %s loaded with %s coins.", height, len(utxo_set))
+            else:
+                log.warning("UTXO snapshot does not match the chain. Replaying all blocks.")
+        for height in range(start, len(self.blockchain)):
+            self.update_unspent_inputs(self.blockchain[height])
+        if self.snapshot_path and start < len(self.blockchain):
+            self.save_snapshot(self.blockchain[-1])
+
+    def save_snapshot(self, block):
+        """Save the UTXO set as of `block`, the last block connected."""
+        save_snapshot(self.unspent_inputs, self.snapshot_path, block["index"], block["hash"])
+
+    def rebuild_unspent_inputs(self):
+        """Rebuild the UTXO set from the snapshot and the chain, for reorgs deeper than the undo records."""
+        self.unspent_inputs = UtxoSet()
+        self.undo.clear()
+        self.load_unspent_inputs()
 
     def update_unspent_inputs(self, block):
-        """Remove used inputs and add new ones"""
-        used_inputs = {}
-        added_inputs = {}
+        """Remove used inputs and add new ones, keeping the spent coins as the block's undo record"""
+        used_inputs = []
+        added_inputs = []
         for transaction in block["transactions"]:
-            tx = Transaction.from_json(transaction)
-            for inp in tx.sender_input:
-                if tx.sender == "Coinbase":
-                    continue
-                input = Input.from_json(inp)
-                if input.address not in used_inputs.keys():
-                    used_inputs[input.address] = []
-                used_inputs[input.address].append(input.to_json())
+            tx = parse_transaction(transaction)
+            if tx.sender != "Coinbase":
+                for inp in tx.sender_input:
+                    used_inputs.append(parse_input(inp).id)
             for out in tx.recipients:
-                output = Input.from_json(out)
-                if output.address not in added_inputs.keys():
-                    added_inputs[output.address] = []
-                added_inputs[output.address].append(output.to_json())
-
-        for public_key, spent_inputs in used_inputs.items():
-            if public_key in self.unspent_inputs:
-                self.unspent_inputs[public_key] = [
-                    input_obj for input_obj in self.unspent_inputs[public_key]
-                    if input_obj not in spent_inputs
-                ]
-                if not self.unspent_inputs[public_key]:
-                    del self.unspent_inputs[public_key]
-
-        for public_key, new_inputs in added_inputs.items():
-            if public_key in self.unspent_inputs:
-                self.unspent_inputs[public_key].extend(new_inputs)
-            else:
-                self.unspent_inputs[public_key] = new_inputs
+                output = parse_input(out)
+                # Outputs of blocks stored before amounts were validated cannot be spent.
+                if valid_amount(output.amount):
+                    added_inputs.append(Coin(output.id, output.address, output.amount))
+
+        spent = []
+        for coin_id in used_inputs:
+            coin = self.unspent_inputs.spend(coin_id)
+            if coin is not None:
+                spent.append(coin)
+        for coin in added_inputs:
+            self.unspent_inputs.add(coin)
+        self.undo[block["hash"]] = spent
+        while len(self.undo) > UNDO_DEPTH:
+            self.undo.popitem(last=False)
+        self.transaction_pool.remove_block(block)
+        if self.snapshot_path and block["index"] % SNAPSHOT_INTERVAL == 0:
+            self.save_snapshot(block)
     
+    def disconnect_block(self, block):
+        """
+        Undo update_unspent_inputs for the tip block. Returns False if its undo
+        record is no longer kept, in which case the set must be rebuilt.
+        """
+        spent = self.undo.pop(block["hash"], None)
+        if spent is None:
+            return False
+        for transaction in block["transactions"]:
+            for out in parse_transaction(transaction).recipients:
+                self.unspent_inputs.spend(parse_input(out).id)
+        for coin in spent:
+            self.unspent_inputs.add(coin)
+        return True
+
+    def return_transactions(self, blocks, confirmed=()):
+        """
+        Pool again the transactions of disconnected blocks whose inputs are still
+        unspent, except those whose id is in `confirmed`. Returns the pooled ones.
+        """
+        pooled = []
+        for block in blocks:
+            for transaction in block["transactions"]:
+                tx = parse_transaction(transaction)
+                if tx.sender == "Coinbase" or tx.transaction_id in confirmed:
+                    continue
+                if all(self.unspent_inputs.get(parse_input(inp).id) is not None for inp in tx.sender_input):
+                    if self.transaction_pool.add(transaction):
+                        log.debug("Transaction added to pool: %s", transaction)
+                        pooled.append(transaction)
+        return pooled
+
     def validate_inputs(self, tx):
-        transaction = Transaction.from_json(tx)
+        transaction = parse_transaction(tx)
         sender = transaction.sender
-        required_amount = Input.from_json(transaction.recipients[0]).amount
+        required_amount = parse_input(transaction.recipients[0]).amount
         selected_inputs = []
 
-        if sender not in self.unspent_inputs:
-            return []
-
         total = 0
-        for input_obj in self.unspent_inputs[sender]:
-            selected_inputs.append(input_obj)
-            total += Input.from_json(input_obj).amount
+        for coin in self.unspent_inputs.coins_of(sender):
+            if coin.id in self.transaction_pool.spends:
+                continue
+            selected_inputs.append(coin.to_json())
+            total += coin.amount
             if total >= required_amount:
-                return [selected_inputs, Input(Input.from_json(input_obj).address, total - required_amount, SHA256.new(str(time.time()+random.random()).encode("utf-8")).hexdigest()).to_json()]
+                return [selected_inputs, Input(coin.address, total - required_amount, SHA256.new(str(time.time()+random.random()).encode("utf-8")).hexdigest()).to_json()]
 
         return []
 
     def get_balance(self, address):
-        total = 0.0
-        try:
-            for input_obj in self.unspent_inputs[address]:
-                total += Input.from_json(input_obj).amount
-        except KeyError:
-            total = 0.0
-        return total
+        return self.unspent_inputs.balance(address)
+
+    def get_balances(self, addresses):
+        return {address: self.unspent_inputs.balance(address) for address in addresses}
             
     def change_owner(self, owner):
         """Assign owner of the miner"""
@@ -112,71 +185,114 @@ class Miner:
             "previous_hash": "0" * 64,
             "nonce": 0,
         }
-        genesis_block["hash"] = DIFFICULTY * '0' + "ab589a2161962fc11a616b271098b4fee6653dbed584d7ced30c76efe4c7bd61"[DIFFICULTY:]
-        print("Genesis block created:", genesis_block)
+        genesis_block["hash"] = self.difficulty * '0' + "ab589a2161962fc11a616b271098b4fee6653dbed584d7ced30c76efe4c7bd61"[self.difficulty:]
+        log.debug("Genesis block created: %s", genesis_block)
         return genesis_block
 
     def add_transaction(self, transaction, pub_key):
         """Add a transaction to the pool."""
-        tx = Transaction.from_json(transaction)
-        key_dict = json.loads(pub_key)
-        pkey = ECC.import_key(base64.b64decode(key_dict["key"]))
-        if tx.verify_signature(pkey):
-            self.transaction_pool.append(tx.to_json())
-
-    def create_block(self):
-        """Create a block and mine it."""
+        return self.add_transactions([(transaction, pub_key)])[0]
+
+    def add_transactions(self, pairs):
+        """Verify a batch of (transaction, public key) pairs and pool the valid ones."""
+        verified = self.verifier.verify_batch(pairs)
+        added = []
+        for (transaction, _), ok in zip(pairs, verified):
+            if ok:
+                tx = parse_transaction(transaction)
+                # Every input must be unspent on chain; the pool rejects spends of the same input.
+                ok = all(self.unspent_inputs.get(parse_input(inp).id) is not None for inp in tx.sender_input)
+                ok = ok and valid_amounts(tx)
+                ok = ok and self.transaction_pool.add(tx.to_json())
+            added.append(ok)
+        return added
+
+    def create_block(self, stop=None):
+        """Create a block and mine it. Returns None if the job was cancelled."""
+        if stop is not None and stop.is_set():
+            return None
         previous_hash = self.blockchain[-1]['hash'] if self.blockchain else '0' * 64
         timestamp = time.time()
         coinbase_transaction = Transaction("Coinbase", self.address, REWARD, timestamp)
-        self.transaction_pool.insert(0, coinbase_transaction.to_json())
+        transactions = [coinbase_transaction.to_json()] + self.transaction_pool.select()
         block = {
             'index': len(self.blockchain),
             'timestamp': timestamp,
-            'transactions': self.transaction_pool,
+            'transactions': transactions,
+            'merkle_root': merkle_root(transactions),
             'previous_hash': previous_hash,
             'nonce': 0
         }
-        self.transaction_pool = []
-        block['hash'] = self.mine_block(block)
+        block_hash = self.mine_block(block, stop)
+        if block_hash is None or block['previous_hash'] != self.blockchain[-1]['hash']:
+            log.debug("Mining on %s abandoned: chain tip changed.", previous_hash)
+            return None
+        block['hash'] = block_hash
         return block
-    
+
     def start_mining(self):
-        """Start mining in a background thread."""
-        future = self.mining_executor.submit(self.create_block)
-        future.add_done_callback(self.block_mined_callback)
+        """Start mining on the current tip in a background thread, cancelling work on a stale tip."""
+        tip = self.blockchain[-1]['hash']
+        with self.mining_lock:
+            if self.mining_job is not None:
+                job_tip, stop = self.mining_job
+                if job_tip == tip and not stop.is_set():
+                    return
+                stop.set()
+            stop = threading.Event()
+            self.mining_job = (tip, stop)
+        future = self.mining_executor.submit(profiler.call, self.create_block, stop)
+        future.add_done_callback(lambda f: self.mining_done(f, tip, stop))
+
+    def stop_mining(self):
+        """Cancel the current mining job."""
+        with self.mining_lock:
+            if self.mining_job is not None:
+                self.mining_job[1].set()
+                self.mining_job = None
+
+    def mining_done(self, future, tip, stop):
+        """Forget the finished job and hand a mined block over."""
+        with self.mining_lock:
+            if self.mining_job == (tip, stop):
+                self.mining_job = None
+        if future.exception() is not None:
+            # Raised in the executor's callback, it would be swallowed and mining would stop.
+            log.error("Mining job failed.", exc_info=future.exception())
+            if self.mining and not stop.is_set():
+                self.start_mining()
+            return
+        if future.result() is not None:
+            self.block_mined_callback(future)
 
     def block_mined_callback(self, future):
-        """Handle the block once mining is complete."""
+        """Handle the block once mining is complete: hand it to the node, or broadcast it to every node."""
         new_block = future.result()
         #self.blockchain.append(new_block)
-        print("New Block Mined:", new_block)
+        log.debug("New Block Mined: %s", new_block)
+        BLOCKS_MINED.inc()
+        if self.on_block_mined is not None:
+            self.on_block_mined(new_block)
+            return
         data = {
             "index": new_block['index'],
             "timestamp": new_block['timestamp'],
             "transactions": new_block['transactions'],
+            "merkle_root": new_block['merkle_root'],
             "previous_hash": new_block['previous_hash'],
             "nonce": new_block['nonce'],
             "hash": new_block['hash']
         }
-        for node_url in self.nodes.values():
-            try:
-                requests.get(f"{node_url['url']}/get_blockchain")
-            except Exception as e:
-                print(f"Error synchronizing with node {node_url}: {e}")
-        broadcast_message('add_block', data, self.nodes)
+        broadcast_message('add_block', codec.encode_block(data), self.nodes, content_type=codec.CONTENT_TYPE)
         #self.start_mining()
 
-    def mine_block(self, block):
-        """Perform proof-of-work to find a valid hash."""
-        #time_start = time.time()
-        while True:
-            block_str = f"{block['index']}{block['timestamp']}{block['transactions']}{block['previous_hash']}{block['nonce']}"
-            block_hash = hashlib.sha256(block_str.encode()).hexdigest()
-            if block_hash.startswith('0' * DIFFICULTY):
-                #print(time.time() - time_start)
-                return block_hash
-            block['nonce'] += 1
+    def mine_block(self, block, stop=None):
+        """Perform proof-of-work to find a valid hash. Returns None if stopped."""
+        block_hash = self.engine.mine(block, self.difficulty, stop)
+        if block_hash is None:
+            return None
+        log.info("Block %s mined at %.0f H/s using %s worker(s).", block['index'], self.engine.hash_rate, self.engine.workers)
+        return block_hash
 
 def serialise_transaction(sender, receiver, amount):
     """Serialise a transaction."""
@@ -1,15 +1,36 @@
 #!/usr/bin/env python3
 
 import argparse
-import hashlib  
+import asyncio
 import json
+import logging
+import os
 import sys
+import threading
+import time
+import urllib.parse
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 import requests
 
-from miner import Miner, deserialise_transaction, DIFFICULTY
+from miner import Miner, DIFFICULTY, valid_amounts
+from transaction import parse_transaction
 from utils import broadcast_message
+from proof_of_work import hash_block
+from merkle import merkle_root, merkle_proof
+from blockstore import BlockStore
+from mempool import Mempool, MAX_COUNT, MAX_BYTES
+from blocktree import BlockTree, ChainView
+from orphans import OrphanPool, MAX_AGE as ORPHAN_MAX_AGE, MAX_BYTES as ORPHAN_MAX_BYTES
+from signatures import SignatureVerifier
+from txindex import TxIndex
+from events import EventLog
+from chaincache import ChainCache
+import chaincache
+import events
+import codec
+import metrics
+import profiler
 
 app = Flask(__name__)
 block_chain = []
@@ -17,14 +38,211 @@ Nodes = {}
 node_name = ''
 messages = {}
 miner = None
-orphan_blocks = []
+orphan_blocks = OrphanPool()
+block_tree = BlockTree(block_chain)
+tx_index = TxIndex()
+chain_lock = threading.RLock()  # Serializes changes to the chain and the UTXO set
+chain_cache = ChainCache(block_chain, chain_lock)
+server = None  # AsyncServer when serving with --server async
+event_log = EventLog()
+published_tip = None  # Hash of the last tip published to subscribers
+aserver = None  # The aserver module, imported with the async server
+admin_api = False  # Whether /admin routes are served, set by --admin-api
+LOOPBACK = ("127.0.0.1", "::1")
+MAX_BLOCKS = 100  # Blocks per /blocks page
+MAX_HEADERS = 2000  # Headers per /headers page
+MAX_HISTORY_PAGE = 50  # Default /address/<address>/history page size
+SYNC_TIMEOUT = 5
+JOIN_ATTEMPTS = 3  # Downloads of the peer's chain tried when joining
+BLOCKS_ACCEPT = f"{codec.CONTENT_TYPE}, application/json;q=0.5"  # Binary block pages preferred
+verified_height = -1  # block_chain[:verified_height + 1] has passed validation
+verified_hash = None  # Hash of block_chain[verified_height]
+log = logging.getLogger("node")
+
+metrics.CHAIN_HEIGHT.set_function(lambda: len(block_chain) - 1)
+metrics.MEMPOOL_TRANSACTIONS.set_function(lambda: len(miner.transaction_pool) if miner else 0)
+metrics.MEMPOOL_BYTES.set_function(lambda: miner.transaction_pool.size if miner else 0)
+metrics.UTXO_COINS.set_function(lambda: len(miner.unspent_inputs) if miner else 0)
+
+
+@app.before_request
+def start_request_timer():
+    g.time_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.time_start, route=route, method=request.method, status=response.status_code)
+    return response
+
+
+@app.before_request
+def start_request_profile():
+    g.profile = profiler.start_thread_profile()
+
+
+@app.teardown_request
+def stop_request_profile(exc):
+    profiler.stop_thread_profile(g.pop("profile", None))
+
 @app.route('/')
 def index() -> str:  
     return "The node is active.\n"
 
+@app.get('/metrics')
+def get_metrics():
+    """Counters and histograms of the node in the Prometheus text format."""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE), 200
+
+@app.post('/admin/profile')
+def profile_node():
+    """
+    Profiles the node for a window and returns the dump. Only served with
+    --admin-api and to local clients.
+    Query: mode 'sample' (collapsed stacks) or 'cprofile', seconds, and for
+    cprofile format 'text' or 'pstats'. Hashing done by mining worker
+    processes is not seen; start the node with --mining-workers 1 to see it.
+    """
+    if not admin_api or request.remote_addr not in LOOPBACK:
+        return jsonify({"error": "The admin API is disabled or not reachable from this address."}), 403
+    mode = request.args.get('mode', 'sample')
+    seconds = request.args.get('seconds', 10, type=float)
+    output_format = request.args.get('format', 'text')
+    try:
+        body, content_type = profiler.run(mode, seconds, output_format)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    return Response(body, mimetype=content_type), 200
+
 @app.get('/get_blockchain')
 def getBlocks() -> str:  
-    return jsonify(block_chain), 200
+    """
+    The whole chain, served from a cache built once per tip. Clients sending
+    the ETag of the current tip in If-None-Match get a 304 without a body.
+    """
+    kind = "binary" if wants_binary() else "json"
+    gzipped = bool(request.accept_encodings["gzip"])
+    tip_hash, height = chaincache.tip_of(block_chain)
+    if request.if_none_match.contains(chaincache.etag(tip_hash, height, kind, gzipped)):
+        return chain_response(304, tip_hash, height, kind, gzipped)
+    tip_hash, height, body = chain_cache.get(kind)
+    if gzipped:
+        response = chain_response(200, tip_hash, height, kind, gzipped, chaincache.stream(body))
+        response.headers["Content-Encoding"] = "gzip"
+        response.content_length = len(body)
+        return response
+    return chain_response(200, tip_hash, height, kind, gzipped, chaincache.stream_decompressed(body))
+
+def chain_response(status, tip_hash, height, kind, gzipped, body=()):
+    mimetype = codec.CONTENT_TYPE if kind == "binary" else "application/json"
+    response = Response(body, status=status, mimetype=mimetype)
+    response.set_etag(chaincache.etag(tip_hash, height, kind, gzipped))
+    response.vary.update(("Accept", "Accept-Encoding"))
+    return response
+
+@app.get('/blocks')
+def get_block_range():
+    """Returns at most `limit` blocks starting at height `from`."""
+    start = max(request.args.get('from', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', MAX_BLOCKS, type=int), 0), MAX_BLOCKS)
+    if wants_binary():
+        return Response(codec.encode_blocks(block_chain[start:start + limit]), mimetype=codec.CONTENT_TYPE), 200
+    return jsonify(block_chain[start:start + limit]), 200
+
+@app.get('/tx/<txid>')
+def get_transaction(txid):
+    """Where a transaction was confirmed, or whether it is still in the pool."""
+    location = tx_index.get(txid)
+    if location is not None and location[0] < len(block_chain):
+        height, position = location
+        block = block_chain[height]
+        return jsonify({
+            "transaction_id": txid,
+            "status": "confirmed",
+            "block_hash": block["hash"],
+            "height": height,
+            "position": position,
+            "confirmations": len(block_chain) - height,
+            "transaction": block["transactions"][position],
+        }), 200
+    pending = miner.transaction_pool.get(txid) if miner is not None else None
+    if pending is not None:
+        return jsonify({
+            "transaction_id": txid,
+            "status": "pending",
+            "transaction": pending,
+        }), 200
+    return jsonify({"error": "Unknown transaction"}), 404
+
+@app.get('/address/<address>/history')
+def get_address_history(address):
+    """
+    Confirmed transactions sending from or paying to an address, newest first.
+    Query: limit, and cursor, the next_cursor of the previous page.
+    """
+    limit = request.args.get('limit', MAX_HISTORY_PAGE, type=int)
+    try:
+        rows, next_cursor = tx_index.history(address, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    transactions = []
+    for txid, height, position in rows:
+        if height >= len(block_chain):
+            continue
+        block = block_chain[height]
+        transactions.append({
+            "transaction_id": txid,
+            "block_hash": block["hash"],
+            "height": height,
+            "position": position,
+            "transaction": block["transactions"][position],
+        })
+    return jsonify({"address": address, "transactions": transactions, "next_cursor": next_cursor}), 200
+
+@app.get('/merkle_proof/<int:height>/<int:position>')
+def get_merkle_proof(height, position):
+    """Proof that the transaction at `position` of block `height` is committed to by its Merkle root."""
+    if not 0 <= height < len(block_chain):
+        return jsonify({"error": "Unknown block"}), 404
+    block = block_chain[height]
+    if "merkle_root" not in block:
+        return jsonify({"error": "Block has no Merkle root"}), 404
+    if not 0 <= position < len(block["transactions"]):
+        return jsonify({"error": "Unknown transaction"}), 404
+    return jsonify({
+        "block_hash": block["hash"],
+        "merkle_root": block["merkle_root"],
+        "transaction": block["transactions"][position],
+        "proof": merkle_proof(block["transactions"], position),
+    }), 200
+
+def wants_binary():
+    """Whether the client accepts the binary encoding of blocks."""
+    return request.accept_mimetypes.best_match(["application/json", codec.CONTENT_TYPE]) == codec.CONTENT_TYPE
+
+@app.post('/headers')
+def get_headers():
+    """Returns headers after the first block of the locator found in the local chain."""
+    data = request.get_json(silent=True) or {}
+    limit = data.get("limit", MAX_HEADERS) if isinstance(data, dict) else None
+    locator = data.get("locator", []) if isinstance(data, dict) else None
+    if not isinstance(limit, int) or not isinstance(locator, list) or not all(
+        isinstance(entry, dict) and isinstance(entry.get("index"), int) and isinstance(entry.get("hash"), str)
+        for entry in locator
+    ):
+        return jsonify({"error": "Invalid limit or locator"}), 400
+    limit = min(max(limit, 0), MAX_HEADERS)
+    start = 0
+    for entry in locator:
+        height = entry["index"]
+        if 0 <= height < len(block_chain) and block_chain[height]["hash"] == entry["hash"]:
+            start = height + 1
+            break
+    headers = [block_header(block) for block in block_chain[start:start + limit]]
+    return jsonify({"start": start, "headers": headers}), 200
 
 @app.route('/add_transaction', methods=['POST'])
 def add_transaction():
@@ -35,10 +253,26 @@ def add_transaction():
         return jsonify({"error": transaction}), 400
         # return jsonify({"error": "Invalid transaction format"}), 400
 
-    miner.add_transaction(transaction, pub_key)
+    if miner.add_transaction(transaction, pub_key):
+        publish_transactions([transaction])
 
     return jsonify({"message": "Transaction added.", "transaction": transaction}), 201
 
+@app.route('/add_transactions', methods=['POST'])
+def add_transactions():
+    """HTTP endpoint to add a batch of [transaction, pub_key] pairs to the miner."""
+    pairs = request.json
+    if not isinstance(pairs, list) or not all(
+        isinstance(pair, list) and len(pair) == 2 and pair[0] and "sender" in pair[0] and "recipients" in pair[0]
+        for pair in pairs
+    ):
+        return jsonify({"error": "Invalid transaction format"}), 400
+
+    added = miner.add_transactions([tuple(pair) for pair in pairs])
+    publish_transactions([pair[0] for pair, ok in zip(pairs, added) if ok])
+
+    return jsonify({"message": f"{sum(added)} of {len(added)} transactions added.", "added": added}), 201
+
 @app.route('/get_inputs', methods=['POST'])
 def get_inputs():
     global miner
@@ -56,11 +290,24 @@ def get_inputs():
 def get_balance():
     global miner
     address = request.json
+    if not isinstance(address, str):
+        return jsonify({"error": "Expected an address"}), 400
 
     balance = miner.get_balance(address)
     
     return jsonify({"message": "Returned balance.", "balance": balance}), 201
 
+@app.route('/get_balances', methods=['POST'])
+def get_balances():
+    global miner
+    addresses = request.json
+    if not isinstance(addresses, list) or not all(isinstance(address, str) for address in addresses):
+        return jsonify({"error": "Expected a list of addresses"}), 400
+
+    balances = miner.get_balances(addresses)
+
+    return jsonify({"message": "Returned balances.", "balances": balances}), 201
+
 @app.post('/nodes')
 def post_nodes():
     new_node = request.json
@@ -88,56 +335,160 @@ def request_and_post_nodes(url):
                     Nodes[name] = info
                     requests.post(info['url'] + '/nodes', json=Nodes[node_name])
     except requests.exceptions.RequestException as e:
-        print(f"Could not get nodes from {url}: {e}")
+        log.warning("Could not get nodes from %s: %s", url, e)
 
 def connect(url):
     try:
-        r = requests.get(f"{url}/get_blockchain")
-        if r.status_code == 200:
-            remote_blockchain = r.json()
-            if remote_blockchain:
-                print(f"Received blockchain from node {url}. Length: {len(remote_blockchain)}")
-                if validate_chain(remote_blockchain):
-                    if validate_chain(block_chain):
-                        if len(remote_blockchain) > len(block_chain):
-                            idx = find_common_index(block_chain, remote_blockchain)
-                            if idx == len(block_chain)-1: 
-                                block_chain.clear()
-                                block_chain.extend(remote_blockchain)
-                                request_and_post_nodes(url)
-                            if idx is not None:
-                                orphan_blocks.extend(block_chain[idx:])
-                                process_orphaned_transactions(block_chain[idx:], block_chain)
-                                block_chain.clear()
-                                block_chain.extend(remote_blockchain)
-                                request_and_post_nodes(url)
-                            print(f"Blockchain synchronized with longer chain from node {url}.")
-                        else:
-                            request_and_post_nodes(url)
-                            print("Broadcasting longer blockchain to the network.")
-                            data = {"blockchain": block_chain}
-                            filtered_nodes = {name: node for i, (name, node) in enumerate(Nodes.items()) if i != 0}
-                            broadcast_message("sync_blockchain", data, nodes=filtered_nodes)
-                    elif len(block_chain) == 0:
+        for _ in range(JOIN_ATTEMPTS):
+            remote_length, remote_blockchain = fetch_missing_blocks(url, len(block_chain))
+            # None for a longer chain: the peer switched branches during the download.
+            if remote_blockchain is not None or remote_length <= len(block_chain):
+                break
+        if remote_length == 0:
+            log.info("Node %s has no blockchain. Skipping sync.", url)
+        elif remote_blockchain is None:
+            if validate_chain(block_chain):
+                request_and_post_nodes(url)
+                log.info("Broadcasting longer blockchain to the network.")
+                # Sent inline: this node is not serving /headers until connect returns.
+                data = {"blockchain": block_chain[:]}
+                filtered_nodes = {name: node for i, (name, node) in enumerate(Nodes.items()) if i != 0}
+                broadcast_message("sync_blockchain", data, nodes=filtered_nodes)
+            else:
+                log.warning("You are trying to synchronize an invalid blockchain")
+        else:
+            log.info("Received blockchain from node %s. Length: %s", url, remote_length)
+            if validate_chain(remote_blockchain):
+                if validate_chain(block_chain):
+                    if find_common_index(block_chain, remote_blockchain) is not None:
+                        replace_chain(remote_blockchain)
                         request_and_post_nodes(url)
-                        print("Synchronized the blockchain")
-                        block_chain.clear()
-                        block_chain.extend(remote_blockchain)
-                    else:   
-                        print(f"You are trying to synchronize an invalid blockchain")
-                else:
-                    print(f"Received blockchain from {url} is invalid. Ignoring.")
+                    log.info("Blockchain synchronized with longer chain from node %s.", url)
+                elif len(block_chain) == 0:
+                    request_and_post_nodes(url)
+                    log.info("Synchronized the blockchain")
+                    replace_chain(remote_blockchain)
+                else:   
+                    log.warning("You are trying to synchronize an invalid blockchain")
             else:
-                print(f"Node {url} has no blockchain. Skipping sync.")
+                log.warning("Received blockchain from %s is invalid. Ignoring.", url)
 
     except requests.exceptions.RequestException as e:
-        print(f"Error synchronizing with {url}: {e}")
+        log.warning("Error synchronizing with %s: %s", url, e)
+
+
+def build_locator(chain):
+    """Block locator: the last blocks of the chain, then exponentially sparser ones down to genesis."""
+    locator = []
+    step = 1
+    height = len(chain) - 1
+    while height > 0:
+        locator.append({"index": height, "hash": chain[height]["hash"]})
+        if len(locator) >= 10:
+            step *= 2
+        height -= step
+    if chain:
+        locator.append({"index": 0, "hash": chain[0]["hash"]})
+    return locator
+
+
+def fetch_missing_blocks(url, fetch_if_longer_than):
+    """
+    Headers-first download of a peer's chain. Fetches the headers after the
+    common ancestor and, only if the peer's chain is longer than
+    `fetch_if_longer_than`, the missing block bodies.
+    Returns (remote length, remote chain built on the local prefix or None).
+    """
+    locator = build_locator(block_chain)
+    headers = []
+    start = None
+    while True:
+        r = requests.post(f"{url}/headers", json={"locator": locator, "limit": MAX_HEADERS}, timeout=SYNC_TIMEOUT)
+        r.raise_for_status()
+        page = r.json()
+        if start is None:
+            start = page["start"]
+        headers.extend(page["headers"])
+        if len(page["headers"]) < MAX_HEADERS:
+            break
+        locator = [{"index": headers[-1]["index"], "hash": headers[-1]["hash"]}]
+
+    remote_length = start + len(headers)
+    if remote_length <= fetch_if_longer_than:
+        return remote_length, None
+
+    blocks = []
+    while len(blocks) < len(headers):
+        r = requests.get(f"{url}/blocks", params={"from": start + len(blocks), "limit": MAX_BLOCKS},
+                         headers={"Accept": BLOCKS_ACCEPT}, timeout=SYNC_TIMEOUT)
+        r.raise_for_status()
+        page = decode_block_page(r.headers.get("Content-Type", ""), r.content)
+        if not page:
+            break
+        blocks.extend(page)
+    return remote_length, remote_chain(url, start, headers, blocks)
+
+
+async def fetch_missing_blocks_async(url, fetch_if_longer_than):
+    """fetch_missing_blocks over the non-blocking client of the async server."""
+    locator = build_locator(block_chain)
+    headers = []
+    start = None
+    while True:
+        page = await server.post_json(f"{url}/headers", {"locator": locator, "limit": MAX_HEADERS}, SYNC_TIMEOUT)
+        if start is None:
+            start = page["start"]
+        headers.extend(page["headers"])
+        if len(page["headers"]) < MAX_HEADERS:
+            break
+        locator = [{"index": headers[-1]["index"], "hash": headers[-1]["hash"]}]
+
+    remote_length = start + len(headers)
+    if remote_length <= fetch_if_longer_than:
+        return remote_length, None
+
+    blocks = []
+    while len(blocks) < len(headers):
+        params = {"from": start + len(blocks), "limit": MAX_BLOCKS}
+        content_type, body = await server.get(f"{url}/blocks", params, {"Accept": BLOCKS_ACCEPT}, SYNC_TIMEOUT)
+        page = decode_block_page(content_type, body)
+        if not page:
+            break
+        blocks.extend(page)
+    return remote_length, remote_chain(url, start, headers, blocks)
+
+
+def decode_block_page(content_type, body):
+    """Blocks of a /blocks response, binary or JSON."""
+    if content_type.startswith(codec.CONTENT_TYPE):
+        return codec.decode_blocks(body)
+    return json.loads(body)
+
+
+def remote_chain(url, start, headers, blocks):
+    """The peer's chain built on the local prefix, or None if the blocks do not match the headers."""
+    # The peer may have extended its chain since it sent the headers.
+    del blocks[len(headers):]
+    if [block["hash"] for block in blocks] != [header["hash"] for header in headers]:
+        log.warning("Blocks from %s do not match the announced headers. Ignoring.", url)
+        return None
+    return ChainView(block_chain, start, blocks)
+
+
+def block_header(block):
+    """Block without its transactions."""
+    return {key: value for key, value in block.items() if key != "transactions"}
 
 @app.route('/get_unspent_inputs', methods=['GET'])
 def get_unspent_inputs():
     """Get all unspent inputs."""
-    return jsonify(miner.unspent_inputs), 200  
+    return jsonify(miner.unspent_inputs.to_dict()), 200  
     
+@app.route('/get_mining_stats', methods=['GET'])
+def get_mining_stats():
+    """Get hash rate of the local mining engine."""
+    return jsonify(miner.engine.stats()), 200
+
 @app.route('/get_messages', methods=['GET'])
 def get_all_messages():
     """Get all received messages."""
@@ -167,92 +518,408 @@ def broadcast_block():
 
 @app.route('/add_block', methods=['POST'])
 def add_block():
-    block = request.json
-    print(f"Received block: {block}")
-    if block["previous_hash"] == block_chain[-1]["hash"]:
-        if validate_block(block):
-            block_chain.append(block)
-            print("Block validated. Adding to chain.")
-            synchronize_blockchain()
-            process_orphan_blocks()
-            miner.update_unspent_inputs(block)
-            if miner.mining:
-                miner.start_mining()
-            return jsonify({"message": "Block added"}), 200
-        else:
-            return jsonify({"error": "Invalid block"}), 400
-    synchronize_blockchain()
-    print("Block does not match current chain. Storing as orphan.")
-    orphan_blocks.append(block)
-    return jsonify({"message": "Orphan block stored"}), 202
+    if request.mimetype == codec.CONTENT_TYPE:
+        try:
+            block = codec.decode_block(request.get_data())
+        except ValueError:
+            return jsonify({"error": "Invalid block encoding"}), 400
+    else:
+        block = request.json
+    log.debug("Received block: %s", block)
+    body, status = receive_block_locked(block)
+    return jsonify(body), status
+
+
+def receive_block_locked(block):
+    with chain_lock:
+        return receive_block(block)
+
+
+def receive_block(block, sync=True):
+    """
+    Connects a block or stores it on a side branch or as an orphan. Returns
+    (response body, status). With `sync` False the caller pulls longer
+    chains from the peers itself.
+    """
+    if not isinstance(block["index"], int):
+        return {"error": "Invalid block"}, 400
+    if block_tree.knows(block["hash"], block["index"]):
+        return {"message": "Block already in chain"}, 200
+    if block_tree.knows(block["previous_hash"], block["index"] - 1):
+        if not attach_block(block):
+            return {"error": "Invalid block"}, 400
+        log.debug("Block validated. Adding to the block tree.")
+        if sync:
+            request_sync()
+        process_orphan_blocks(block["hash"])
+        process_orphan_blocks()
+        on_tip_changed()
+        return {"message": "Block added"}, 200
+    if hash_block(block) != block["hash"] or not block["hash"].startswith(DIFFICULTY * "0"):
+        return {"error": "Invalid block"}, 400
+    log.info("Block does not match current chain. Storing as orphan.")
+    if orphan_blocks.add(block):
+        metrics.BLOCKS_ORPHANED.inc(reason="unconnected")
+    if sync:
+        request_sync()
+    process_orphan_blocks()
+    return {"message": "Orphan block stored"}, 202
+
+
+@app.post('/inv')
+def receive_inventory():
+    """
+    Block announcement {"hash", "height", "url"}. The body is fetched from
+    the announcing node only if the block is unknown here.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("hash"), str) or not isinstance(data.get("url"), str) \
+            or not isinstance(data.get("height"), int) or isinstance(data["height"], bool):
+        return jsonify({"error": "Invalid announcement"}), 400
+    if not trusted_announcer(data["url"]):
+        return jsonify({"error": "Announcements are only fetched from known nodes."}), 403
+    if block_known(data["hash"], data["height"]):
+        return jsonify({"message": "Block already known"}), 200
+    if server is not None:
+        server.submit(fetch_announced_block_async, data["url"], data["height"], data["hash"])
+        return jsonify({"message": "Block requested."}), 202
+    try:
+        block = fetch_announced_block(data["url"], data["height"], data["hash"])
+    except requests.exceptions.RequestException as e:
+        log.warning("Could not fetch block %s from %s: %s", data['hash'], data['url'], e)
+        return jsonify({"error": "Could not reach the announcing node."}), 502
+    if block is None:
+        return jsonify({"error": "Announced block is not served."}), 404
+    body, status = receive_block_locked(block)
+    return jsonify(body), status
+
+
+def trusted_announcer(url):
+    """Whether an announced block may be fetched from `url`: a known node, or one on the announcing host."""
+    if any(info.get("url") == url for info in list(Nodes.values())):
+        return True
+    parts = urllib.parse.urlsplit(url)
+    return parts.scheme == "http" and parts.hostname == request.remote_addr
+
 
+def block_known(block_hash, height):
+    return block_tree.knows(block_hash, height) or block_hash in orphan_blocks
+
+
+def fetch_announced_block(url, height, block_hash):
+    """Body of an announced block from the announcing node, or None if it no longer serves it."""
+    r = requests.get(f"{url}/blocks", params={"from": height, "limit": 1},
+                     headers={"Accept": BLOCKS_ACCEPT}, timeout=SYNC_TIMEOUT)
+    r.raise_for_status()
+    return announced_block(decode_block_page(r.headers.get("Content-Type", ""), r.content), block_hash)
+
+
+async def fetch_announced_block_async(url, height, block_hash):
+    """fetch_announced_block on the event loop; only connecting the block takes a worker."""
+    if block_known(block_hash, height):
+        return
+    try:
+        params = {"from": height, "limit": 1}
+        content_type, body = await server.get(f"{url}/blocks", params, {"Accept": BLOCKS_ACCEPT}, SYNC_TIMEOUT)
+    except aserver.PEER_ERRORS as e:
+        log.warning("Could not fetch block %s from %s: %s", block_hash, url, e)
+        return
+    block = announced_block(decode_block_page(content_type, body), block_hash)
+    if block is not None:
+        await server.run_in_worker(receive_block_locked, block)
+
+
+def announced_block(page, block_hash):
+    # The announcing node may have switched to another branch since.
+    if not page or page[0]["hash"] != block_hash:
+        log.warning("Announced block %s is no longer served.", block_hash)
+        return None
+    return page[0]
+
+
+def announce_block(block):
+    """Sends the hash and height of a block to the peers, which fetch the body if they lack it."""
+    data = {"hash": block["hash"], "height": block["index"], "url": Nodes[node_name]["url"]}
+    peers = {name: info for name, info in list(Nodes.items()) if name != node_name}
+    broadcast_message("inv", data, peers)
+
+
+def block_mined(block):
+    """
+    Connects a block mined here like a received one and announces it if it
+    is the new tip. Peers are synced afterwards, without the chain lock.
+    """
+    with chain_lock:
+        body, status = receive_block(block, sync=False)
+        if status >= 400:
+            log.warning("Mined block %s was rejected: %s", block['index'], body["error"])
+            return
+        on_main_chain = block_tree.on_main_chain(block["hash"], block["index"])
+    if on_main_chain:
+        announce_block(block)
+    else:
+        log.info("Mined block %s is not on the main chain. Not announced.", block['index'])
+    request_sync_unlocked()
+
+
+@app.get('/subscribe')
+def subscribe():
+    """
+    New tips and mempool entries. Query: since, the last event id seen
+    (default: now), types, a comma separated subset of tip,mempool, and
+    timeout. Answers with the events after `since`, waiting up to `timeout`
+    seconds for one (long-poll), or with Accept: text/event-stream streams
+    them as server-sent events.
+    """
+    try:
+        last_seen, kinds, timeout = events.parse_query(request.args, event_log)
+        last_seen = int(request.headers.get("Last-Event-ID", last_seen))
+    except ValueError:
+        return jsonify({"error": "Invalid query"}), 400
+    if events.wants_stream(request.headers.get("Accept")):
+        def stream():
+            resume = last_seen
+            while True:
+                found, resume = event_log.since(resume, kinds)
+                if found:
+                    yield events.server_sent(found)
+                elif not event_log.wait(resume, events.KEEPALIVE):
+                    yield ": keepalive\n\n"
+
+        return Response(stream_with_context(stream()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+    found, resume = event_log.since(last_seen, kinds)
+    if not found and event_log.wait(resume, timeout):
+        found, resume = event_log.since(resume, kinds)
+    return jsonify(events.page(found, resume)), 200
 
 @app.route('/get_orphan_blocks', methods=['GET'])
 def get_orphan_blocks():
-    return jsonify(orphan_blocks), 200
+    with chain_lock:
+        orphan_blocks.expire()
+        return jsonify(list(orphan_blocks)), 200
 
 @app.route('/sync_blockchain', methods=['POST'])
 def sync_blockchain():
     data = request.json
-    remote_blockchain = data.get("blockchain", [])
+    if "url" in data:
+        if server is not None:
+            server.submit(sync_with_peer_async, data["url"])
+            return jsonify({"message": "Blockchain synchronization scheduled."}), 202
+        try:
+            remote_length, remote_blockchain = fetch_missing_blocks(data["url"], len(block_chain) - 1)
+        except requests.exceptions.RequestException as e:
+            log.warning("Error synchronizing with %s: %s", data['url'], e)
+            return jsonify({"error": "Could not reach the announcing node."}), 502
+        if remote_blockchain is None:
+            log.debug("Received blockchain is shorter or equal. No synchronization needed.")
+            return jsonify({"message": "Blockchain synchronization complete."}), 200
+    else:
+        remote_blockchain = data.get("blockchain", [])
+    with chain_lock:
+        sync_with(remote_blockchain)
+    return jsonify({"message": "Blockchain synchronization complete."}), 200
+
+
+async def sync_with_peer_async(url):
+    """The url announcement of /sync_blockchain, fetched on the event loop."""
+    try:
+        _, remote_blockchain = await fetch_missing_blocks_async(url, len(block_chain) - 1)
+    except aserver.PEER_ERRORS as e:
+        log.warning("Error synchronizing with %s: %s", url, e)
+        return
+    if remote_blockchain is not None:
+        await server.run_in_worker(sync_with_locked, remote_blockchain)
+
+
+def sync_with_locked(remote_blockchain):
+    with chain_lock:
+        sync_with(remote_blockchain)
 
-    if remote_blockchain == block_chain:
-        return jsonify({"message": "Blockchain synchronization complete."}), 200
+
+def sync_with(remote_blockchain):
+    """Switches to an announced chain with more work, or keeps an equal one as a side branch."""
+    if not remote_blockchain or remote_blockchain[-1]["hash"] == block_chain[-1]["hash"]:
+        return
 
     if len(remote_blockchain) >= len(block_chain):
-        print(f"Received a blockchain from another node. Length: {len(remote_blockchain)}")
+        log.info("Received a blockchain from another node. Length: %s", len(remote_blockchain))
         if validate_chain(remote_blockchain):
             idx = find_common_index(block_chain, remote_blockchain)
-            if len(remote_blockchain) == len(block_chain) and idx == len(block_chain)-1:
-                block_chain.clear()
-                block_chain.extend(remote_blockchain)
-            elif idx == len(block_chain)-1 and len(remote_blockchain) > len(block_chain): 
-                block_chain.clear()
-                block_chain.extend(remote_blockchain)
-            elif idx < len(block_chain)-1 and len(remote_blockchain) > len(block_chain):
-                orphan_blocks.extend(block_chain[max(idx,1):])
-                process_orphaned_transactions(block_chain[max(idx,1):], block_chain)
-                block_chain.clear()
-                block_chain.extend(remote_blockchain)
-            elif idx < len(block_chain)-1 and len(remote_blockchain) == len(block_chain):
-                orphan_blocks.extend(remote_blockchain[max(idx,1):])
-                process_orphaned_transactions(remote_blockchain[max(idx,1):], block_chain)
-            print("Blockchain synchronized with the received chain.")
+            if chain_work(remote_blockchain) > block_tree.tip_work():
+                replace_chain(remote_blockchain)
+            elif idx is not None:
+                # Equal work: the first chain seen stays active, the other one is kept as a side branch.
+                competing = remote_blockchain[idx + 1:]
+                for block in competing:
+                    block_tree.add_side(block)
+                metrics.BLOCKS_ORPHANED.inc(len(competing), reason="competing")
+            log.info("Blockchain synchronized with the received chain.")
         else:
-            print("Received blockchain is invalid. Ignoring.")
+            log.warning("Received blockchain is invalid. Ignoring.")
     else:
-        print("Received blockchain is shorter or equal. No synchronization needed.")
-    return jsonify({"message": "Blockchain synchronization complete."}), 200
+        log.debug("Received blockchain is shorter or equal. No synchronization needed.")
+
 
 
 
+def request_sync():
+    """
+    Pulls longer chains from the peers: right away in the threaded server, in
+    the background on the event loop with the async server.
+    """
+    if server is not None:
+        server.submit(synchronize_blockchain_async)
+    else:
+        synchronize_blockchain()
+
+
+def request_sync_unlocked():
+    """request_sync for callers not holding the chain lock: peers are queried without it."""
+    if server is not None:
+        server.submit(synchronize_blockchain_async)
+        return
+    chains = []
+    for name, info in list(Nodes.items()):
+        if name == node_name:
+            continue
+        try:
+            _, remote_blockchain = fetch_missing_blocks(info['url'], len(block_chain))
+        except requests.exceptions.RequestException as e:
+            log.warning("Error synchronizing with %s: %s", name, e)
+            continue
+        if remote_blockchain is not None:
+            chains.append((name, remote_blockchain))
+    if chains:
+        adopt_longest_chain(chains)
+
+
+def acceptable_chain(node_name, remote_blockchain):
+    """Whether a peer's chain shares the genesis and is valid."""
+    if not has_common_block(block_chain, remote_blockchain):
+        log.warning("No common block with %s. Chain rejected.", node_name)
+        return False
+    if not validate_chain(remote_blockchain):
+        return False
+    log.info("Synchronizing with %s. Found a longer chain.", node_name)
+    return True
+
 
 def synchronize_blockchain():
     """Synchronizes blockchain with other nodes"""
-    global block_chain, orphan_blocks
     longest_chain = block_chain
-    for node_name, node_info in Nodes.items():
+    for node_name, node_info in list(Nodes.items()):
         try:
-            response = requests.get(f"{node_info['url']}/get_blockchain")
-            if response.status_code == 200:
-                remote_blockchain = response.json()
-                if not has_common_block(block_chain, remote_blockchain):
-                    print(f"No common block with {node_name}. Chain rejected.")
-                    continue
-
-                if len(remote_blockchain) > len(longest_chain) and validate_chain(remote_blockchain):
-                    print(f"Synchronizing with {node_name}. Found a longer chain.")
-                    found_orphans = find_orphan_blocks(block_chain, remote_blockchain)
-                    orphan_blocks.extend(found_orphans)
-                    process_orphaned_transactions(found_orphans, block_chain)
-                    longest_chain = remote_blockchain
+            _, remote_blockchain = fetch_missing_blocks(node_info['url'], len(longest_chain))
+            if remote_blockchain is not None and acceptable_chain(node_name, remote_blockchain):
+                longest_chain = remote_blockchain
         except requests.exceptions.RequestException as e:
-            print(f"Error synchronizing with {node_name}: {e}")
-
-    if longest_chain != block_chain:
-        print("Replacing current chain with the longest chain.")
-        block_chain = longest_chain
-        print(f"Updated chain. Orphan blocks: {len(orphan_blocks)}")
+            log.warning("Error synchronizing with %s: %s", node_name, e)
+
+    if longest_chain is not block_chain:
+        log.info("Replacing current chain with the longest chain.")
+        replace_chain(longest_chain)
+        log.info("Updated chain. Orphan blocks: %s", len(orphan_blocks))
+
+
+async def synchronize_blockchain_async():
+    """
+    synchronize_blockchain with all peers queried at once on the event loop.
+    Only switching to the longest valid chain takes a worker thread.
+    """
+    peers = [(name, info["url"]) for name, info in list(Nodes.items()) if name != node_name]
+    results = await asyncio.gather(*(fetch_missing_blocks_async(url, len(block_chain)) for _, url in peers),
+                                   return_exceptions=True)
+    chains = []
+    for (name, _), result in zip(peers, results):
+        if isinstance(result, aserver.PEER_ERRORS):
+            log.warning("Error synchronizing with %s: %s", name, result)
+        elif isinstance(result, BaseException):
+            raise result
+        elif result[1] is not None:
+            chains.append((name, result[1]))
+    if chains:
+        await server.run_in_worker(adopt_longest_chain, chains)
+
+
+def adopt_longest_chain(chains):
+    """Switches to the longest valid chain of (node name, chain) pairs if it has more work."""
+    with chain_lock:
+        for name, remote_blockchain in sorted(chains, key=lambda chain: len(chain[1]), reverse=True):
+            if chain_work(remote_blockchain) <= block_tree.tip_work():
+                return
+            if acceptable_chain(name, remote_blockchain):
+                log.info("Replacing current chain with the longest chain.")
+                replace_chain(remote_blockchain)
+                process_orphan_blocks()
+                return
+
+
+def replace_chain(new_chain):
+    """
+    Replaces the chain in place, so the miner keeps working on the same list.
+    The new chain must have passed validate_chain; only the blocks after the
+    common ancestor are disconnected and connected.
+    """
+    fork_height = find_common_index(block_chain, new_chain)
+    if fork_height is None:
+        fork_height = -1
+    switch_chain(fork_height, new_chain[fork_height + 1:])
+
+
+def switch_chain(fork_height, blocks):
+    """
+    Makes block_chain[:fork_height + 1] followed by the validated `blocks` the
+    active chain. The blocks above the fork are disconnected tip first using
+    their undo records and kept as a side branch, so the cost follows the depth
+    of the reorganization rather than the length of the chain.
+    """
+    disconnected = block_chain[fork_height + 1:]
+    rebuild = False
+    for block in reversed(disconnected):
+        tx_index.disconnect_block(block)
+        if miner is not None and not rebuild:
+            rebuild = not miner.disconnect_block(block)
+    del block_chain[fork_height + 1:]
+    for block in disconnected:
+        block_tree.add_side(block)
+
+    for block in blocks:
+        block_chain.append(block)
+        tx_index.connect_block(block)
+        block_tree.remove_side(block["hash"])
+        if miner is not None and not rebuild:
+            miner.update_unspent_inputs(block)
+    if rebuild:
+        log.warning("Reorganization deeper than the undo records. Rebuilding the UTXO set.")
+        miner.rebuild_unspent_inputs()
+    mark_verified(len(block_chain) - 1)
+    block_tree.prune()
+    metrics.BLOCKS_ACCEPTED.inc(len(blocks))
+
+    if disconnected:
+        log.info("Reorganized %s blocks from height %s.", len(disconnected), fork_height + 1)
+        metrics.BLOCKS_ORPHANED.inc(len(disconnected), reason="reorg")
+        if miner is not None:
+            publish_transactions(miner.return_transactions(disconnected, confirmed=tx_index))
+    on_tip_changed()
+
+
+def on_tip_changed():
+    """Moves mining over to the current tip, dropping work on the old one, and tells subscribers."""
+    global published_tip
+    chain_cache.invalidate()
+    tip = block_chain[-1]
+    if tip["hash"] != published_tip:
+        published_tip = tip["hash"]
+        event_log.publish("tip", {"hash": tip["hash"], "height": tip["index"]})
+    if miner is not None and miner.mining:
+        miner.start_mining()
+
+
+def publish_transactions(transactions):
+    """Tells subscribers about transactions entering the pool."""
+    for transaction in transactions:
+        event_log.publish("mempool", {"transaction_id": parse_transaction(transaction).transaction_id, "transaction": transaction})
 
 
 def has_common_block(local_chain, external_chain):
@@ -272,113 +939,216 @@ def has_common_block(local_chain, external_chain):
 
 
 def find_common_index(local_chain, remote_chain):
-    common_index = None
-    for i in range(min(len(local_chain), len(remote_chain))):
-        if local_chain[i]["hash"] == remote_chain[i]["hash"]:
-            common_index = i
+    """Highest height at which both chains have the same block, or None. Binary searched like verified_prefix."""
+    low, high = -1, min(len(local_chain), len(remote_chain)) - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if local_chain[mid]["hash"] == remote_chain[mid]["hash"]:
+            low = mid
         else:
-            break
-    return common_index
+            high = mid - 1
+    return low if low >= 0 else None
+
+
+def chain_work(chain):
+    """Cumulative work of a chain sharing the genesis of the local one."""
+    return block_tree.work_at(len(chain) - 1)
+
 
 
 
 
+def mark_verified(height):
+    """Remembers that the local chain is valid up to `height`."""
+    global verified_height, verified_hash
+    verified_height = height
+    verified_hash = block_chain[height]["hash"] if height >= 0 else None
 
-def validate_block(block):
-    """Waliduje otrzymany blok."""
+
+def verified_prefix(chain):
+    """
+    Returns the highest height at which `chain` shares a block with the verified
+    part of the local chain, or -1. Hashes are chained, so a match at some height
+    implies a match at every lower one and the ancestor can be binary searched.
+    """
+    low, high = -1, min(verified_height, len(chain) - 1)
+    if high == verified_height >= 0 and chain[high]["hash"] == verified_hash:
+        # The usual case: `chain` extends the whole verified part.
+        return high
+    while low < high:
+        mid = (low + high + 1) // 2
+        if chain[mid]["hash"] == block_chain[mid]["hash"]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+@metrics.VALIDATE_BLOCK_SECONDS.time()
+def validate_block(block, parent=None):
+    """Waliduje otrzymany blok. Checked against the tip unless a known `parent` is given."""
     if not block_chain:
         # Genesis block
         return block["previous_hash"] == "0" * 64
 
-    last_block = block_chain[-1]
+    last_block = parent if parent is not None else block_chain[-1]
     return (
         block["previous_hash"] == last_block["hash"]
         and block["index"] == last_block["index"] + 1
         and block["hash"].startswith(DIFFICULTY * "0")
-        and deserialise_transaction(block["transactions"][0])["sender"] == "Coinbase"
+        and hash_block(block) == block["hash"]
+        and valid_merkle_root(block)
+        and parse_transaction(block["transactions"][0]).sender == "Coinbase"
+        and all(valid_amounts(parse_transaction(transaction)) for transaction in block["transactions"])
     )
 
+def valid_merkle_root(block):
+    """Blocks hashed over a Merkle root must commit to their transactions."""
+    return "merkle_root" not in block or block["merkle_root"] == merkle_root(block["transactions"])
+
+def append_block(block):
+    """Appends a block that passed validate_block, extending the verified prefix."""
+    block_chain.append(block)
+    tx_index.connect_block(block)
+    metrics.BLOCKS_ACCEPTED.inc()
+    if verified_height == len(block_chain) - 2:
+        mark_verified(len(block_chain) - 1)
+
+@metrics.VALIDATE_CHAIN_SECONDS.time()
 def validate_chain(chain):
-    """Validates the whole chain."""
+    """
+    Validates the chain. Blocks shared with the verified part of the local chain
+    are not hashed again, only the ones after the common ancestor.
+    """
     if not chain:
         return False
 
+    start = verified_prefix(chain) + 1
+    if start > 0:
+        if not check_blocks(chain, start):
+            return False
+        if chain is block_chain:
+            mark_verified(len(chain) - 1)
+        return True
+
     genesis_block = chain[0]
     if genesis_block["previous_hash"] != "0" * 64:
-        print("Invalid genesis block: Incorrect previous hash.")
+        log.warning("Invalid genesis block: Incorrect previous hash.")
         return False
 
     
     genesis_block_hash = DIFFICULTY * '0' + "ab589a2161962fc11a616b271098b4fee6653dbed584d7ced30c76efe4c7bd61"[DIFFICULTY:]
     if genesis_block_hash != genesis_block["hash"] or not genesis_block_hash.startswith("0" * DIFFICULTY):
-        print("Invalid genesis block: Hash does not match or difficulty not met.")
+        log.warning("Invalid genesis block: Hash does not match or difficulty not met.")
         return False
 
-    for i in range(1, len(chain)):
+    if not check_blocks(chain, 1):
+        return False
+    if chain is block_chain:
+        mark_verified(len(chain) - 1)
+    return True
+
+
+def check_blocks(chain, start):
+    """Checks links and proof-of-work of chain[start:]."""
+    for i in range(start, len(chain)):
         current_block = chain[i]
         previous_block = chain[i - 1]
 
         if current_block["previous_hash"] != previous_block["hash"]:
-            print(f"Invalid block at index {i}: Previous hash does not match.")
+            log.warning("Invalid block at index %s: Previous hash does not match.", i)
             return False
 
-        block_str = f"{current_block['index']}{current_block['timestamp']}{current_block['transactions']}{current_block['previous_hash']}{current_block['nonce']}"
-        block_hash = hashlib.sha256(block_str.encode()).hexdigest()
+        if not valid_merkle_root(current_block):
+            log.warning("Invalid block at index %s: Merkle root does not match the transactions.", i)
+            return False
+
+        block_hash = hash_block(current_block)
         if block_hash != current_block["hash"] or not block_hash.startswith("0" * DIFFICULTY):
-            print(f"block_str: {block_str}")
-            print(f"hash calculated: {block_hash}")
-            print(f"current_block: {current_block['hash']}")
-            print(f"Invalid block at index {i}: Hash does not match or difficulty not met.")
+            log.debug("hash calculated: %s", block_hash)
+            log.debug("current_block: %s", current_block['hash'])
+            log.warning("Invalid block at index %s: Hash does not match or difficulty not met.", i)
             return False
 
     return True
 
 
-def process_orphan_blocks():
-    """Tries to add orphan blocks to blockchain."""
-    global orphan_blocks
-    new_orphan_blocks = []
-    for block in orphan_blocks:
-        if block["previous_hash"] == block_chain[-1]["hash"]:
-            if validate_block(block):
-                block_chain.append(block)
-                print("Orphan block added to blockchain.")
-            else:
-                print("Invalid orphan block.")
-                new_orphan_blocks.append(block)
-        else:
-            new_orphan_blocks.append(block)
-    orphan_blocks = new_orphan_blocks
+def attach_block(block):
+    """
+    Adds a block whose parent is known. It extends the tip, or goes to a side
+    branch that becomes the active chain once it has more cumulative work.
+    Returns False if the block is invalid.
+    """
+    if block["previous_hash"] == block_chain[-1]["hash"]:
+        if not validate_block(block):
+            return False
+        append_block(block)
+        if miner is not None:
+            miner.update_unspent_inputs(block)
+        return True
 
-def find_orphan_blocks(old_chain, new_chain):
-    """Returns orphaned blocks."""
-    new_chain_hashes = {block["hash"] for block in new_chain} 
-    orphaned_blocks = [
-        block for block in old_chain if block["hash"] not in new_chain_hashes
-    ]
-    return orphaned_blocks
+    parent = block_tree.get(block["previous_hash"], block["index"] - 1)
+    if not validate_block(block, parent):
+        return False
+    if block_tree.add_side(block) > block_tree.tip_work():
+        fork_height, branch = block_tree.branch(block["hash"])
+        switch_chain(fork_height, branch)
+    else:
+        log.info("Block %s stored on a side branch.", block['index'])
+    return True
 
 
-def process_orphaned_transactions(orphan_blocks, block_chain):
-    global miner
+def process_orphan_blocks(block_hash=None):
+    """Connects the longest chain of orphans descending from a known block, by default the tip."""
+    connected = False
+    for block in orphan_blocks.longest_chain_from(block_hash or block_chain[-1]["hash"]):
+        orphan_blocks.remove(block["hash"])
+        if not attach_block(block):
+            log.warning("Invalid orphan block.")
+            break
+        log.info("Orphan block added to the block tree.")
+        connected = True
+    if connected:
+        on_tip_changed()
 
-    existing_transactions = set(
-        tx for block in block_chain for tx in block["transactions"]
-    )
-    
-    for block in orphan_blocks:
-        for transaction in block["transactions"]:
-            if transaction not in existing_transactions:
-                if transaction not in miner.transaction_pool:
-                    miner.transaction_pool.append(transaction)
-                    print(f"Transaction added to pool: {transaction}")
+
+def index_chain():
+    """Catches the transaction index up with the chain loaded or downloaded at startup."""
+    indexed = tx_index.sync(block_chain)
+    if indexed:
+        log.info("Transaction index updated with %s blocks.", indexed)
 
 
+def serve(args):
+    """Serves the API with the threaded Flask server or, with --server async, from an event loop."""
+    global server
+    global aserver
+    try:
+        if args.server == "async":
+            import aserver
+            server = aserver.AsyncServer(app, args.workers, event_log)
+            server.run('127.0.0.1', int(node_name))
+        else:
+            app.run(host='127.0.0.1', port=node_name, threaded=True, use_reloader=False)
+    finally:
+        # The async server exits gracefully on SIGTERM; no block may be broadcast after it.
+        if miner is not None:
+            miner.mining = False
+            miner.stop_mining()
+        if isinstance(block_chain, BlockStore):
+            block_chain.close()
+        tx_index.close()
 
 
 def main(app: Flask) -> int:
     global node_name
     global miner
+    global block_chain
+    global block_tree
+    global tx_index
+    global chain_cache
+    global admin_api
+    global DIFFICULTY
     parser = argparse.ArgumentParser()
     parser.add_argument('--init', help='Initialise the first node.', action='store_true')
     parser.add_argument('--join', help='Create a new node. Please specify the port of the node it should be connected to')
@@ -386,30 +1156,71 @@ def main(app: Flask) -> int:
     parser.add_argument('--miner', help='If used, the created node will also serve as a miner and the user with the given name will be the owner of the miner')
     parser.add_argument('--malicious', help='Simulate a malicious fork.', type=str)
     parser.add_argument('--predefined-blocks', help='Path to a file containing predefined blocks.', type=str)
+    parser.add_argument('--datadir', help='Directory of the on-disk block store. Without it the chain is kept in memory only.', type=str)
+    parser.add_argument('--mempool-max-count', help='Maximum number of pending transactions.', type=int, default=MAX_COUNT)
+    parser.add_argument('--mempool-max-bytes', help='Maximum total size of pending transactions in bytes.', type=int, default=MAX_BYTES)
+    parser.add_argument('--orphan-max-age', help='Seconds an orphan block is kept.', type=float, default=ORPHAN_MAX_AGE)
+    parser.add_argument('--orphan-max-bytes', help='Maximum total size of orphan blocks in bytes.', type=int, default=ORPHAN_MAX_BYTES)
+    parser.add_argument('--verify-workers', help='Number of processes used for signature verification. Defaults to the number of cores.', type=int)
+    parser.add_argument('--mining-workers', help='Number of processes used for mining. Defaults to the number of cores.', type=int)
+    parser.add_argument('--log-level', help='Verbosity of the node log.', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO')
+    parser.add_argument('--admin-api', help='Serve /admin/profile to requests from this host.', action='store_true')
+    parser.add_argument('--profile', help='Profile the node from startup, by sampling stacks or with cProfile. Mines in the node process, as if --mining-workers 1, so hashing shows up under mine_block.', choices=profiler.MODES)
+    parser.add_argument('--profile-seconds', help='Length of the startup profiling window.', type=float, default=60)
+    parser.add_argument('--profile-output', help='File the startup profile is written to.', type=str, default='profile.out')
+    parser.add_argument('--server', help='Threaded Flask server, or asyncio server handing requests to a pool of workers (needs aiohttp).', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--workers', help='Request handler threads of the async server.', type=int)
+    parser.add_argument('--difficulty', help='Number of leading zeros required in block hashes. All nodes of a network must agree on it.', type=int, default=DIFFICULTY)
 
     args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # The per-request access log is only written at DEBUG
+    logging.getLogger("werkzeug").setLevel(logging.DEBUG if args.log_level == "DEBUG" else logging.WARNING)
+    admin_api = args.admin_api
+    if args.profile:
+        # Neither mode sees into mining worker processes.
+        if args.mining_workers not in (None, 1):
+            log.warning("Mining with 1 worker instead of %s while profiling.", args.mining_workers)
+        args.mining_workers = 1
+        profiler.run_to_file(args.profile, args.profile_seconds, args.profile_output)
+        log.info("Profiling for %s s into %s.", args.profile_seconds, args.profile_output)
 
     node_name = str(args.port)
+    DIFFICULTY = args.difficulty
 
     Nodes[node_name] = {}
     Nodes[node_name]['name'] = node_name
     Nodes[node_name]['url'] = "http://127.0.0.1:"+node_name
     Nodes[node_name]['join'] = "init"
 
+    mempool = Mempool(args.mempool_max_count, args.mempool_max_bytes)
+    orphan_blocks.max_age = args.orphan_max_age
+    orphan_blocks.max_bytes = args.orphan_max_bytes
+    verifier = SignatureVerifier(args.verify_workers or os.cpu_count() or 1)
+    snapshot_path = None
+    if args.datadir:
+        block_chain = BlockStore(args.datadir)
+        snapshot_path = os.path.join(args.datadir, "utxo.snapshot")
+        log.info("Block store opened at %s with %s blocks.", args.datadir, len(block_chain))
+    block_tree = BlockTree(block_chain, DIFFICULTY)
+    chain_cache = ChainCache(block_chain, chain_lock)
+    if args.datadir:
+        tx_index = TxIndex(os.path.join(args.datadir, "txindex.sqlite"))
+
     if args.predefined_blocks:
         try:
             with open(args.predefined_blocks, 'r') as file:
                 predefined_blocks = json.load(file)
                 if not block_chain:
                     block_chain.extend(predefined_blocks)
-                    print(f"Predefined blockchain loaded with {len(predefined_blocks)} blocks from {args.predefined_blocks}.")
+                    log.info("Predefined blockchain loaded with %s blocks from %s.", len(predefined_blocks), args.predefined_blocks)
                 else:
-                    print(f'Blockchain: {block_chain}')
-                    print("Cannot load predefined blocks: Blockchain already initialized.")
+                    log.debug("Blockchain: %s", block_chain)
+                    log.warning("Cannot load predefined blocks: Blockchain already initialized.")
         except FileNotFoundError:
-            print(f"Error: File {args.predefined_blocks} not found.")
+            log.error("Error: File %s not found.", args.predefined_blocks)
         except json.JSONDecodeError as e:
-            print(f"Error loading predefined blocks: {e}")
+            log.error("Error loading predefined blocks: %s", e)
     
     if args.malicious:
         try:
@@ -417,38 +1228,42 @@ def main(app: Flask) -> int:
                 predefined_blocks = json.load(file)
                 if not block_chain:
                     block_chain.extend(predefined_blocks)
-                    print(f"Predefined blockchain loaded with {len(predefined_blocks)} blocks from {args.malicious}.")
+                    log.info("Predefined blockchain loaded with %s blocks from %s.", len(predefined_blocks), args.malicious)
                 else:
-                    print(f'Blockchain: {block_chain}')
-                    print("Cannot load predefined blocks: Blockchain already initialized.")
+                    log.debug("Blockchain: %s", block_chain)
+                    log.warning("Cannot load predefined blocks: Blockchain already initialized.")
         except FileNotFoundError:
-            print(f"Error: File {args.malicious} not found.")
+            log.error("Error: File %s not found.", args.malicious)
         except json.JSONDecodeError as e:
-            print(f"Error loading predefined blocks: {e}")
+            log.error("Error loading predefined blocks: %s", e)
+
+    index_chain()
 
     if args.init:   
-        miner = Miner(block_chain, Nodes, args.miner) 
+        miner = Miner(block_chain, Nodes, args.miner, args.mining_workers, snapshot_path, mempool, verifier, DIFFICULTY, block_mined)
         if not block_chain:
             block_chain.append(miner.create_genesis_block())
-            print(f"Node {node_name} initialized with Genesis Block.")
+            log.info("Node %s initialized with Genesis Block.", node_name)
+        index_chain()
         if args.miner:
             miner.mining = True
             miner.start_mining()
-        app.run(host='127.0.0.1', port=node_name, threaded=True, use_reloader=False)
+        serve(args)
         return 0 
 
     elif args.join:
         Nodes[node_name]['join'] = str(args.join)
-        print(f"Node {node_name} joining node {args.join}.")
+        log.info("Node %s joining node %s.", node_name, args.join)
         connect(f"http://127.0.0.1:{args.join}")
-        miner = Miner(block_chain, Nodes, args.miner)
+        miner = Miner(block_chain, Nodes, args.miner, args.mining_workers, snapshot_path, mempool, verifier, DIFFICULTY, block_mined)
+        index_chain()
         if args.miner:
             miner.mining = True
             miner.start_mining()
-        app.run(host='127.0.0.1', port=node_name, threaded=True, use_reloader=False)
+        serve(args)
         return 0  
     else:
-        print("No valid arguments provided. Exiting.")
+        log.error("No valid arguments provided. Exiting.")
         return 1
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+import time
+from collections import OrderedDict
+
+import codec
+
+MAX_AGE = 3600  # Seconds an orphan is kept
+MAX_BYTES = 16 * 1024 * 1024  # Encoded size of the orphans held at most
+
+
+class OrphanEntry:
+    __slots__ = ("block", "size", "added")
+
+    def __init__(self, block, added):
+        """
+        Pool entry: the block, its encoded size and when it arrived.
+        """
+        self.block = block
+        self.size = len(codec.encode_block(block))
+        self.added = added
+
+
+class OrphanPool:
+    def __init__(self, max_age=MAX_AGE, max_bytes=MAX_BYTES):
+        """
+        Blocks that do not extend the chain, indexed by hash and by the hash of
+        their parent. Entries are kept in arrival order; they expire after
+        `max_age` seconds, checked whenever orphans are added or looked up,
+        and the oldest are evicted first beyond `max_bytes`.
+        """
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # block hash -> OrphanEntry
+        self.by_parent = {}  # previous hash -> {block hash, ...}
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.entries
+
+    def __iter__(self):
+        return (entry.block for entry in self.entries.values())
+
+    def add(self, block):
+        """Store a block; returns False for duplicates and blocks evicted at once."""
+        if block["hash"] in self.entries:
+            return False
+        now = time.time()
+        entry = OrphanEntry(block, now)
+        self.entries[block["hash"]] = entry
+        self.by_parent.setdefault(block["previous_hash"], set()).add(block["hash"])
+        self.size += entry.size
+        self.expire(now)
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+        return block["hash"] in self.entries
+
+    def extend(self, blocks):
+        for block in blocks:
+            self.add(block)
+
+    def remove(self, block_hash):
+        """Drop a block; returns it or None."""
+        entry = self.entries.pop(block_hash, None)
+        if entry is None:
+            return None
+        siblings = self.by_parent[entry.block["previous_hash"]]
+        siblings.discard(block_hash)
+        if not siblings:
+            del self.by_parent[entry.block["previous_hash"]]
+        self.size -= entry.size
+        return entry.block
+
+    def expire(self, now=None):
+        """Drop the orphans older than max_age."""
+        deadline = (now or time.time()) - self.max_age
+        while self.entries:
+            block_hash, entry = next(iter(self.entries.items()))
+            if entry.added > deadline:
+                break
+            self.remove(block_hash)
+
+    def children(self, block_hash):
+        """Orphans whose parent is `block_hash`."""
+        self.expire()
+        return [self.entries[child].block for child in self.by_parent.get(block_hash, ())]
+
+    def longest_chain_from(self, block_hash):
+        """
+        Longest chain of orphans descending from `block_hash`, parent first.
+        Ties go to the branch that arrived first.
+        """
+        self.expire()
+        # Depth of every descendant, computed leaves first
+        order = []
+        visited = set()
+        stack = [block_hash]
+        while stack:
+            current = stack.pop()
+            if current in visited:
+                continue
+            visited.add(current)
+            order.append(current)
+            stack.extend(self.by_parent.get(current, ()))
+        depth = {}
+        best_child = {}
+        for current in reversed(order):
+            children = sorted(self.by_parent.get(current, ()), key=lambda child: self.entries[child].added)
+            children = [child for child in children if child in depth]
+            best = max(children, key=lambda child: depth[child], default=None)
+            best_child[current] = best
+            depth[current] = 1 + (depth[best] if best is not None else 0)
+
+        chain = []
+        current = best_child[block_hash]
+        while current is not None:
+            chain.append(self.entries[current].block)
+            current = best_child[current]
+        return chain
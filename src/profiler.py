@@ -0,0 +1,173 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005  # Seconds between two stack samples
+MAX_SECONDS = 300  # Longest profiling window
+MODES = ("sample", "cprofile")
+
+# From 3.12 cProfile uses sys.monitoring: a single profiler per process, covering all threads
+PROCESS_WIDE = sys.version_info >= (3, 12)
+
+session = None  # Active cProfile window, None while profiling is off
+running = threading.Lock()  # Held while a window of either mode runs
+
+
+def thread_label(name):
+    """Thread name without its counters, so threads of one pool share a stack root."""
+    return re.sub(r"[-_]?\d+", "", name)
+
+
+def collapse(frame):
+    """Stack of a frame, outermost call first, as ';'-separated function names."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample(seconds, interval=SAMPLE_INTERVAL):
+    """
+    Samples the stacks of all threads for `seconds` and returns them in the
+    collapsed format of flame graph tools, one 'stack count' line per stack.
+    Waiting threads are sampled too, so time spent blocked on locks shows up.
+    """
+    own = threading.get_ident()
+    counts = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread_label(thread.name) for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != own:
+                counts[f"{names.get(ident, ident)};{collapse(frame)}"] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class ProfileSession:
+    def __init__(self):
+        """
+        cProfile window; each thread profiles its own work and adds it here.
+        """
+        self.stats = None
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+
+def start_thread_profile():
+    """
+    Starts profiling the calling thread if a cProfile window is open. Does
+    nothing where the window's own profiler already covers every thread.
+    """
+    if session is None or PROCESS_WIDE:
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Another profiler is active on this thread
+        return None
+    return (session, profile)
+
+
+def stop_thread_profile(started):
+    """Stops a profile returned by start_thread_profile and adds it to its window."""
+    if started is None:
+        return
+    window, profile = started
+    profile.disable()
+    window.add(profile)
+
+
+def call(function, *args):
+    """Calls the function, profiled if a cProfile window is open."""
+    started = start_thread_profile()
+    try:
+        return function(*args)
+    finally:
+        stop_thread_profile(started)
+
+
+def profile_window(seconds):
+    """
+    Opens a cProfile window for `seconds`. Covers the requests and mining jobs
+    that both start and finish inside it, or from Python 3.12 everything the
+    process runs meanwhile. Returns the merged pstats.Stats or None.
+    """
+    global session
+    window = ProfileSession()
+    if PROCESS_WIDE:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            raise RuntimeError(f"cannot start cProfile: {e}")
+        try:
+            time.sleep(seconds)
+        finally:
+            profile.disable()
+        window.add(profile)
+        return window.stats
+    session = window
+    try:
+        time.sleep(seconds)
+    finally:
+        session = None
+    return window.stats
+
+
+def run(mode, seconds, output_format="text"):
+    """
+    Profiles the process for a window and returns (body, content type).
+    Sampling returns collapsed stacks; cProfile returns a text report or,
+    with output_format 'pstats', the marshalled stats that pstats can load.
+    Only this process is profiled: work handed to worker processes, such as
+    hashing with several mining workers, shows up as a wait.
+    Raises RuntimeError if another window is running.
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown profiling mode: {mode}")
+    seconds = min(max(seconds, 0.1), MAX_SECONDS)
+    if not running.acquire(blocking=False):
+        raise RuntimeError("a profiling window is already running")
+    try:
+        if mode == "sample":
+            return sample(seconds), "text/plain"
+        stats = profile_window(seconds)
+        if output_format == "pstats":
+            return marshal.dumps(stats.stats if stats is not None else {}), "application/octet-stream"
+        if stats is None:
+            return "No profiled activity.\n", "text/plain"
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats("cumulative").print_stats(100)
+        return stream.getvalue(), "text/plain"
+    finally:
+        running.release()
+
+
+def run_to_file(mode, seconds, path, output_format="text"):
+    """Profiles a window in the background and writes the result to `path`."""
+    def target():
+        body, _ = run(mode, seconds, output_format)
+        with open(path, "wb") as file:
+            file.write(body if isinstance(body, bytes) else body.encode())
+
+    thread = threading.Thread(target=target, name="profiler", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,134 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from metrics import HASHES, HASH_RATE
+
+CHUNK_SIZE = 20_000  # Nonces handed to a worker at a time, also the cancellation granularity
+
+
+def block_prefix(block):
+    """
+    Constant part of the hashed block string, everything except the nonce.
+    Blocks with a Merkle root hash a fixed-size header; older blocks hash the
+    full list of transactions.
+    """
+    if "merkle_root" in block:
+        return f"{block['index']}{block['timestamp']}{block['merkle_root']}{block['previous_hash']}"
+    return f"{block['index']}{block['timestamp']}{block['transactions']}{block['previous_hash']}"
+
+
+def hash_block(block):
+    """Hash of the block as computed by the proof-of-work."""
+    return hashlib.sha256(f"{block_prefix(block)}{block['nonce']}".encode()).hexdigest()
+
+
+def search_nonces(prefix, start, count, difficulty):
+    """
+    Scan nonces [start, start + count) for a hash with `difficulty` leading zeros.
+    Returns (nonce, hash, hashes_done); nonce and hash are None when nothing was found.
+    """
+    midstate = hashlib.sha256(prefix.encode())
+    zero_bytes = bytes(difficulty // 2)
+    half_byte = difficulty % 2
+    n = len(zero_bytes)
+    for nonce in range(start, start + count):
+        attempt = midstate.copy()
+        attempt.update(str(nonce).encode())
+        digest = attempt.digest()
+        if digest[:n] == zero_bytes and (not half_byte or digest[n] < 16):
+            return nonce, digest.hex(), nonce - start + 1
+    return None, None, count
+
+
+class MiningEngine:
+    def __init__(self, workers=None, chunk_size=CHUNK_SIZE):
+        """
+        Proof-of-work engine splitting the nonce space across worker processes.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.executor = None
+        if self.workers > 1:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        self.hashes = 0
+        self.elapsed = 0.0
+        self.hash_rate = 0.0
+
+    def mine(self, block, difficulty, stop=None):
+        """
+        Search nonces from block['nonce'] on; sets the winning nonce and returns the hash.
+        Returns None if the `stop` event is set before a hash is found.
+        """
+        prefix = block_prefix(block)
+        time_start = time.time()
+        hashes = 0
+        if self.executor is None:
+            next_nonce = block['nonce']
+            while True:
+                if stop is not None and stop.is_set():
+                    nonce = block_hash = None
+                    break
+                nonce, block_hash, done = search_nonces(prefix, next_nonce, self.chunk_size, difficulty)
+                hashes += done
+                if nonce is not None:
+                    break
+                next_nonce += self.chunk_size
+        else:
+            nonce, block_hash, hashes = self._mine_parallel(prefix, block['nonce'], difficulty, stop)
+        self._record(hashes, time.time() - time_start)
+        if nonce is None:
+            return None
+        block['nonce'] = nonce
+        return block_hash
+
+    def _mine_parallel(self, prefix, next_nonce, difficulty, stop):
+        """Keep one chunk per worker in flight until one of them finds a hash."""
+        hashes = 0
+        pending = set()
+        for _ in range(self.workers):
+            pending.add(self.executor.submit(search_nonces, prefix, next_nonce, self.chunk_size, difficulty))
+            next_nonce += self.chunk_size
+        while True:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            found = None
+            for future in finished:
+                nonce, block_hash, done = future.result()
+                hashes += done
+                if nonce is not None and (found is None or nonce < found[0]):
+                    found = (nonce, block_hash)
+            if found is not None or (stop is not None and stop.is_set()):
+                for future in pending:
+                    future.cancel()
+                if found is None:
+                    return None, None, hashes
+                return found[0], found[1], hashes
+            for _ in finished:
+                pending.add(self.executor.submit(search_nonces, prefix, next_nonce, self.chunk_size, difficulty))
+                next_nonce += self.chunk_size
+
+    def _record(self, hashes, elapsed):
+        self.hashes += hashes
+        self.elapsed += elapsed
+        self.hash_rate = hashes / elapsed if elapsed > 0 else 0.0
+        HASHES.inc(hashes)
+        HASH_RATE.set(self.hash_rate)
+
+    def stats(self):
+        """Hashing statistics of the engine."""
+        return {
+            "workers": self.workers,
+            "hashes": self.hashes,
+            "seconds": self.elapsed,
+            "hash_rate": self.hash_rate,
+            "average_hash_rate": self.hashes / self.elapsed if self.elapsed > 0 else 0.0,
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,93 @@
+import base64
+import functools
+import hashlib
+import json
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from Crypto.PublicKey import ECC
+
+from transaction import parse_transaction
+
+KEY_CACHE_SIZE = 4096  # Parsed public keys kept per process
+VERIFIED_CACHE_SIZE = 100_000  # Verified signatures remembered
+PARALLEL_THRESHOLD = 16  # Smaller batches are verified on the calling thread
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def import_public_key(key):
+    """Parses a base64 encoded PEM public key, once per key."""
+    return ECC.import_key(base64.b64decode(key))
+
+
+def verify_transaction(transaction, pub_key):
+    """Checks the signature of a serialized transaction against a serialized public key."""
+    try:
+        tx = parse_transaction(transaction)
+        return tx.verify_signature(import_public_key(json.loads(pub_key)["key"]))
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+def cache_key(transaction, pub_key):
+    """Compact key of a (transaction, public key) pair; the transaction includes its id and signature."""
+    return hashlib.sha256(f"{transaction}\0{pub_key}".encode()).digest()
+
+
+def verify_pairs(pairs):
+    """verify_transaction over a list of (transaction, public key) pairs."""
+    return [verify_transaction(transaction, pub_key) for transaction, pub_key in pairs]
+
+
+class SignatureVerifier:
+    def __init__(self, workers=1, parallel_threshold=PARALLEL_THRESHOLD):
+        """
+        Verifies transaction signatures, spreading large batches over worker processes
+        and remembering (transaction, key) pairs that were already verified.
+        """
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self.executor = None
+        if workers > 1:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        self.verified = OrderedDict()
+        self.lock = threading.Lock()
+
+    def verify(self, transaction, pub_key):
+        return self.verify_batch([(transaction, pub_key)])[0]
+
+    def verify_batch(self, pairs):
+        """Returns one boolean per (transaction, public key) pair."""
+        results = [False] * len(pairs)
+        keys = [cache_key(transaction, pub_key) for transaction, pub_key in pairs]
+        pending = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.verified:
+                    self.verified.move_to_end(key)
+                    results[i] = True
+                else:
+                    pending.append(i)
+
+        to_check = [pairs[i] for i in pending]
+        if self.executor is not None and len(to_check) >= self.parallel_threshold:
+            chunk = -(-len(to_check) // self.workers)
+            checked = []
+            for part in self.executor.map(verify_pairs, [to_check[j:j + chunk] for j in range(0, len(to_check), chunk)]):
+                checked.extend(part)
+        else:
+            checked = verify_pairs(to_check)
+
+        with self.lock:
+            for i, ok in zip(pending, checked):
+                results[i] = ok
+                if ok:
+                    self.verified[keys[i]] = True
+            while len(self.verified) > VERIFIED_CACHE_SIZE:
+                self.verified.popitem(last=False)
+        return results
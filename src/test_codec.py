@@ -0,0 +1,48 @@
+import unittest
+
+import codec
+
+
+def make_block(**fields):
+    output = codec.input_json("ab" * 32, "ab cd ", 10)
+    transaction = codec.transaction_json("cd" * 64, 1.5, "Coinbase", [], None, [output])
+    block = {
+        "index": 1,
+        "timestamp": 1700000000.25,
+        "nonce": 42,
+        "previous_hash": "00" * 32,
+        "hash": "0f" * 32,
+        "merkle_root": "ee" * 32,
+        "transactions": [transaction],
+    }
+    block.update(fields)
+    return block
+
+
+class CodecRoundTripTest(unittest.TestCase):
+    def assertRoundTrip(self, block):
+        self.assertEqual(codec.decode_block(codec.encode_block(block)), block)
+        self.assertEqual(codec.decode_blocks(codec.encode_blocks([block, block])), [block, block])
+
+    def test_canonical_block(self):
+        self.assertRoundTrip(make_block())
+
+    def test_ids_hex_apart_from_whitespace(self):
+        # bytes.fromhex skips whitespace; such ids must not be stored as hex
+        output = codec.input_json("ab cd ", "ab cd ", 10)
+        transaction = codec.transaction_json("ab cd ", 1.5, " ab", [output], None, [output])
+        self.assertRoundTrip(make_block(transactions=[transaction], previous_hash="00 " * 2))
+
+    def test_upper_case_hex(self):
+        self.assertRoundTrip(make_block(hash="AB" * 32))
+
+    def test_header_fields_that_are_not_numbers(self):
+        self.assertRoundTrip(make_block(timestamp="1.0", nonce=None, index=True))
+        self.assertRoundTrip(make_block(nonce=2 ** 64))
+
+    def test_hashes_that_are_not_strings(self):
+        self.assertRoundTrip(make_block(previous_hash=0, merkle_root=["x"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import base64
+import functools
 import json
 import random
 import requests
@@ -7,9 +8,12 @@ import time
 from Crypto.Hash import SHA512, SHA256
 from Crypto.Signature import DSS
 
+PARSE_CACHE_SIZE = 65536  # Parsed transactions and inputs kept per kind
 
 
 class Transaction:
+    __slots__ = ("transaction_id", "timestamp", "sender", "sender_input", "recipients", "signature")
+
     def __init__(self, sender, recipients, amount, timestamp, transaction_id=None, signature=None, sender_input=[]):
         """
         Initialize a transaction object.
@@ -17,9 +21,7 @@ class Transaction:
         self.transaction_id = transaction_id
         self.timestamp = timestamp
         self.sender = sender
-        self.sender_input = []
-        for input in sender_input:
-            self.sender_input.append(input)
+        self.sender_input = list(sender_input)
         if type(recipients) == str:
             self.recipients = [Input(recipients, amount, SHA256.new(str(time.time()+random.random()).encode("utf-8")).hexdigest()).to_json()]
         else:
@@ -95,6 +97,8 @@ class Transaction:
     
 
 class Input:
+    __slots__ = ("id", "address", "amount")
+
     def __init__(self, address, amount, id):
         """
         Input of a transaction.
@@ -124,3 +128,49 @@ class Input:
             address=data["address"],
             amount=data["amount"],
         )
+
+
+class Frozen:
+    """
+    Objects shared through the parse caches: setting or deleting an attribute
+    raises AttributeError, and their lists are tuples.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def copy_of(cls, obj):
+        frozen = object.__new__(cls)
+        for name in obj.__slots__:
+            value = getattr(obj, name)
+            object.__setattr__(frozen, name, tuple(value) if isinstance(value, list) else value)
+        return frozen
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is shared through the parse cache and cannot be modified")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is shared through the parse cache and cannot be modified")
+
+
+class ParsedTransaction(Frozen, Transaction):
+    __slots__ = ()
+
+
+class ParsedInput(Frozen, Input):
+    __slots__ = ()
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_transaction(json_str):
+    """
+    Cached Transaction.from_json. The object is shared between callers and cannot be modified.
+    """
+    return ParsedTransaction.copy_of(Transaction.from_json(json_str))
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_input(json_str):
+    """
+    Cached Input.from_json. The object is shared between callers and cannot be modified.
+    """
+    return ParsedInput.copy_of(Input.from_json(json_str))
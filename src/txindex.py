@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+
+from transaction import parse_transaction, parse_input
+
+SYNC_BATCH = 1000  # Blocks indexed per commit when catching up with the chain
+SCHEMA_VERSION = 2  # Databases of another version are indexed again
+MAX_HISTORY = 500  # History entries per page
+
+
+def transaction_addresses(tx):
+    """Addresses a transaction sends from or pays to."""
+    addresses = {parse_input(out).address for out in tx.recipients}
+    if tx.sender != "Coinbase":
+        addresses.add(tx.sender)
+        addresses.update(parse_input(inp).address for inp in tx.sender_input)
+    addresses.discard(None)
+    return addresses
+
+
+def format_cursor(height, position):
+    return f"{height}:{position}"
+
+
+def parse_cursor(cursor):
+    """(height, position) of a cursor; raises ValueError if it is malformed."""
+    height, position = cursor.split(":")
+    return int(height), int(position)
+
+
+class TxIndex:
+    def __init__(self, path=":memory:"):
+        """
+        Transaction id -> (block height, position in the block) for the main
+        chain, and the history of every address, in an SQLite database at
+        `path`. The hash of every indexed block is stored as well, so after a
+        restart the index can tell which of its blocks are still on the chain.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            for table in ("transactions", "history", "blocks"):
+                self.db.execute(f"DROP TABLE IF EXISTS {table}")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.execute("CREATE TABLE IF NOT EXISTS transactions (txid TEXT PRIMARY KEY, height INTEGER NOT NULL, position INTEGER NOT NULL) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS transactions_height ON transactions (height)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS history (address TEXT, height INTEGER, position INTEGER, txid TEXT NOT NULL, PRIMARY KEY (address, height, position)) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_height ON history (height)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS blocks (height INTEGER PRIMARY KEY, hash TEXT NOT NULL)")
+        self.db.commit()
+
+    def __contains__(self, transaction_id):
+        return self.get(transaction_id) is not None
+
+    def get(self, transaction_id):
+        """(height, position) of a confirmed transaction, or None."""
+        with self.lock:
+            return self.db.execute("SELECT height, position FROM transactions WHERE txid = ?", (transaction_id,)).fetchone()
+
+    def history(self, address, cursor=None, limit=MAX_HISTORY):
+        """
+        Up to `limit` (transaction id, height, position) of an address, newest
+        first, starting after `cursor`. Returns them with the cursor of the
+        next page, None after the last one.
+        """
+        limit = min(max(limit, 1), MAX_HISTORY)
+        height, position = parse_cursor(cursor) if cursor else (2 ** 62, 0)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT txid, height, position FROM history WHERE address = ? AND (height, position) < (?, ?)"
+                " ORDER BY height DESC, position DESC LIMIT ?",
+                (address, height, position, limit + 1),
+            ).fetchall()
+        next_cursor = format_cursor(*rows[limit - 1][1:]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def _insert(self, block):
+        rows = []
+        history = []
+        for position, transaction in enumerate(block["transactions"]):
+            # Parsed through the same cache as Miner.update_unspent_inputs
+            tx = parse_transaction(transaction)
+            rows.append((tx.transaction_id, block["index"], position))
+            history.extend((address, block["index"], position, tx.transaction_id) for address in transaction_addresses(tx))
+        self.db.executemany("INSERT OR REPLACE INTO transactions VALUES (?, ?, ?)", rows)
+        self.db.executemany("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?)", history)
+        self.db.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?)", (block["index"], block["hash"]))
+
+    def _delete_above(self, height):
+        self.db.execute("DELETE FROM transactions WHERE height > ?", (height,))
+        self.db.execute("DELETE FROM history WHERE height > ?", (height,))
+        self.db.execute("DELETE FROM blocks WHERE height > ?", (height,))
+
+    def connect_block(self, block):
+        """Index a block appended to the main chain."""
+        with self.lock:
+            self._insert(block)
+            self.db.commit()
+
+    def disconnect_block(self, block):
+        """Drop the transactions of a block removed from the tip of the main chain."""
+        with self.lock:
+            self._delete_above(block["index"] - 1)
+            self.db.commit()
+
+    def sync(self, chain):
+        """
+        Bring the index in line with `chain`: blocks indexed off the chain are
+        dropped and the blocks after the last matching one are indexed.
+        Cost follows the number of blocks that differ.
+        """
+        with self.lock:
+            height = -1
+            for indexed_height, block_hash in self.db.execute("SELECT height, hash FROM blocks ORDER BY height DESC"):
+                if indexed_height < len(chain) and chain[indexed_height]["hash"] == block_hash:
+                    height = indexed_height
+                    break
+            self._delete_above(height)
+            for start in range(height + 1, len(chain), SYNC_BATCH):
+                for block in chain[start:start + SYNC_BATCH]:
+                    self._insert(block)
+                self.db.commit()
+            self.db.commit()
+            return len(chain) - 1 - height
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,19 +1,76 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import BROADCAST_SECONDS, BROADCAST_FAILURES
+
+BROADCAST_WORKERS = 16
+broadcast_executor = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix="broadcast")
+sessions = {}
+sessions_lock = threading.Lock()
+log = logging.getLogger("utils")
+
+
+def get_session(node_url):
+    """Returns the persistent session, and so the connection pool, of a peer."""
+    with sessions_lock:
+        session = sessions.get(node_url)
+        if session is None:
+            session = requests.Session()
+            session.mount(node_url, HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            sessions[node_url] = session
+        return session
+
+
+def post_to_node(node_name, node_url, endpoint, data, timeout, content_type=None):
+    """Posts a message to one node and reports the outcome."""
+    time_start = time.time()
+    try:
+        log.debug("Broadcasting to %s at %s/%s", node_name, node_url, endpoint)
+        if content_type:
+            response = get_session(node_url).post(f"{node_url}/{endpoint}", data=data, headers={"Content-Type": content_type}, timeout=timeout)
+        else:
+            response = get_session(node_url).post(f"{node_url}/{endpoint}", json=data, timeout=timeout)
+        latency = time.time() - time_start
+        delivered = 200 <= response.status_code < 300
+        if delivered:
+            log.debug("Successfully broadcasted to %s", node_name)
+        else:
+            log.warning("Failed to broadcast to %s. Status: %s", node_name, response.status_code)
+        return {"ok": delivered, "status": response.status_code, "latency": latency}
+    except requests.exceptions.RequestException as e:
+        log.warning("Error broadcasting to %s: %s", node_name, e)
+        return {"ok": False, "status": None, "latency": time.time() - time_start, "error": str(e)}
+
 
 # TODO: Broadcast na nody połączone do peera inita
-def broadcast_message(endpoint, data, nodes, timeout=5):
-    """Broadcast a message to all nodes."""
-    for idx, (node_name, node_info) in enumerate(nodes.items()):
-        # if idx == 0:
-        #     continue
-        try:
-            node_url = node_info['url']
-            print(f"Broadcasting to {node_name} at {node_url}/{endpoint}")
-            response = requests.post(f"{node_url}/{endpoint}", json=data, timeout=timeout)
-            if response.status_code == 200:
-                print(f"Successfully broadcasted to {node_name}")
-            else:
-                print(f"Failed to broadcast to {node_name}. Status: {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error broadcasting to {node_name}: {e}")
+def broadcast_message(endpoint, data, nodes, timeout=5, content_type=None):
+    """
+    Broadcast a message to all nodes at once.
+    `data` is sent as JSON, or as is with the given `content_type`.
+    Each node gets its own deadline, `timeout` or the node's own 'timeout' entry.
+    Returns the delivery result and latency per node name.
+    """
+    time_start = time.time()
+    futures = {}
+    for node_name, node_info in list(nodes.items()):
+        node_timeout = node_info.get('timeout', timeout)
+        future = broadcast_executor.submit(post_to_node, node_name, node_info['url'], endpoint, data, node_timeout, content_type)
+        futures[node_name] = (future, time_start + node_timeout)
 
+    results = {}
+    for node_name, (future, deadline) in futures.items():
+        try:
+            results[node_name] = future.result(timeout=max(deadline - time.time(), 0))
+        except TimeoutError:
+            log.warning("Error broadcasting to %s: deadline exceeded", node_name)
+            results[node_name] = {"ok": False, "status": None, "latency": time.time() - time_start, "error": "deadline exceeded"}
+        result = results[node_name]
+        BROADCAST_SECONDS.observe(result["latency"], peer=node_name, endpoint=endpoint)
+        if not result["ok"]:
+            BROADCAST_FAILURES.inc(peer=node_name, endpoint=endpoint)
+    return results
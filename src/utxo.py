@@ -0,0 +1,135 @@
+import json
+import math
+import os
+from decimal import Decimal
+
+
+class Coin:
+    __slots__ = ("id", "address", "amount")
+
+    def __init__(self, id, address, amount):
+        """
+        Unspent transaction output.
+        """
+        self.id = id
+        self.address = address
+        self.amount = amount
+
+    def to_json(self):
+        """
+        Serialize the coin the same way as the Input it was created from.
+        """
+        return json.dumps({
+            "id": self.id,
+            "address": self.address,
+            "amount": self.amount,
+        })
+
+
+def valid_amount(amount):
+    """Whether an output amount is a finite number."""
+    return not isinstance(amount, bool) and isinstance(amount, (int, float)) and math.isfinite(amount)
+
+
+def to_decimal(amount):
+    """Exact decimal value of an amount as written in its output."""
+    if not valid_amount(amount):
+        raise ValueError(f"invalid amount: {amount!r}")
+    return Decimal(str(amount))
+
+
+class UtxoSet:
+    def __init__(self):
+        """
+        Unspent outputs keyed by output id, with a secondary index by address.
+        Per address, coins are kept in the order they were created and their
+        total is kept up to date as coins are added and spent, as a Decimal
+        so that it does not drift from the sum of the coins.
+        """
+        self.coins = {}
+        self.by_address = {}
+        self.balances = {}
+
+    def __len__(self):
+        return len(self.coins)
+
+    def get(self, coin_id):
+        return self.coins.get(coin_id)
+
+    def add(self, coin):
+        """
+        Add an unspent output. An output with the same id is replaced. Raises
+        ValueError, leaving the set unchanged, if the amount is not a number.
+        """
+        amount = to_decimal(coin.amount)
+        if coin.id in self.coins:
+            self.spend(coin.id)
+        self.coins[coin.id] = coin
+        self.by_address.setdefault(coin.address, {})[coin.id] = coin
+        self.balances[coin.address] = self.balances.get(coin.address, Decimal(0)) + amount
+
+    def spend(self, coin_id):
+        """Remove an output; returns it, or None if it was not unspent."""
+        coin = self.coins.pop(coin_id, None)
+        if coin is None:
+            return None
+        address_coins = self.by_address[coin.address]
+        del address_coins[coin_id]
+        if address_coins:
+            self.balances[coin.address] -= to_decimal(coin.amount)
+        else:
+            del self.by_address[coin.address]
+            del self.balances[coin.address]
+        return coin
+
+    def coins_of(self, address):
+        """
+        Unspent outputs of an address, oldest first. A copy: request threads
+        read the set while blocks are connected.
+        """
+        return list(self.by_address.get(address, {}).values())
+
+    def balance(self, address):
+        """Sum of the unspent outputs of an address."""
+        return float(self.balances.get(address, 0))
+
+    def to_dict(self):
+        """Unspent outputs as {address: [json, ...]}, read from copies like coins_of."""
+        return {
+            address: [coin.to_json() for coin in list(coins.values())]
+            for address, coins in list(self.by_address.items())
+        }
+
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(utxo_set, path, height, tip_hash):
+    """Write the set to `path` as of the block `tip_hash` at `height`."""
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "height": height,
+        "tip": tip_hash,
+        "coins": [[coin.id, coin.address, coin.amount] for coin in utxo_set.coins.values()],
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(snapshot, file, separators=(",", ":"))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    """Returns (utxo set, height, tip hash) from `path`, or None if there is no usable snapshot."""
+    try:
+        with open(path, "r") as file:
+            snapshot = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    utxo_set = UtxoSet()
+    for coin_id, address, amount in snapshot["coins"]:
+        utxo_set.add(Coin(coin_id, address, amount))
+    return utxo_set, snapshot["height"], snapshot["tip"]